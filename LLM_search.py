@@ -1,78 +1,331 @@
-import google.generativeai as genai
 import re
-from PIL import Image
-from dotenv import load_dotenv
-import os
-import open_clip
-from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient, models as rest
-from PIL import Image
-import torch
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 
-load_dotenv('data.env')
-
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-
-model = genai.GenerativeModel("gemini-2.0-flash")
+from answer_cache import AnswerCache
+from batching import MicroBatcher
+from lazy import LazyResource, STARTUP_TIMINGS
+from metrics import stage, observe_stage, count, observe, submit, COUNT_BUCKETS
+from reranker import CrossEncoderTextReranker, ClipImageReranker, rerank
+from thumbnails import load_thumbnail
+from vector_store import SearchRequest, open_store, COLLECTION_NAME
 
-text_model = SentenceTransformer("intfloat/e5-base")
+load_dotenv('data.env')
 
-clip_model, _, preprocess = open_clip.create_model_and_transforms(
-    'ViT-L-14', pretrained='laion2b_s32b_b82k'
-)
-clip_model.eval()
-tokenizer = open_clip.get_tokenizer('ViT-L-14')
+GEMINI_MODEL_NAME = "gemini-2.0-flash"
+TEXT_MODEL_NAME = "intfloat/e5-base"
+CLIP_MODEL_NAME = "ViT-L-14"
+CLIP_PRETRAINED = "laion2b_s32b_b82k"
+# Query encoding only needs the CLIP text tower; set CLIP_TEXT_ONLY=0 to load the full model.
+CLIP_TEXT_ONLY = os.getenv("CLIP_TEXT_ONLY", "1") != "0"
+TEXT_VECTOR = "text"
+IMAGE_VECTOR = "image"
+RETRIEVAL_WORKERS = 8
+# Written by ingest_data after every upsert; its mtime is part of the collection version for the answer cache.
+INGEST_MANIFEST_PATH = "data/ingest_manifest.json"
+CACHE_VERSION_CHECK_INTERVAL = 30
+# Text points are passage chunks; fetch this many times top_k so enough distinct articles remain after collapsing.
+CHUNK_OVERSAMPLING = 3
+# Approximate e5 (WordPiece) token budget for all article content in the prompt; None disables packing.
+CONTEXT_TOKEN_BUDGET = 3000
+MAX_SENTENCES_PER_HIT = 60
+# With reranking on, a local reranker orders the hits and Gemini only writes the answer for the top ones.
+RERANKING = os.getenv("RERANKING", "1") != "0"
+RERANK_TEXT_TOP_K = 5
+RERANK_IMAGE_TOP_K = 5
+# Opt-in semantic answer cache: the cosine similarity above which another query's answer is reused.
+# Unset disables it; calibrate on real query pairs before enabling.
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY")) if os.getenv("ANSWER_CACHE_SIMILARITY") else None
+
+def _create_gemini_model():
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+
+def _create_text_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(TEXT_MODEL_NAME)
+
+
+def _load_clip_text_tower():
+    """
+    Builds only the CLIP text transformer and loads its weights from the pretrained checkpoint,
+    so the vision tower is never materialised. The tower runs the same modules and weights as
+    CLIP.encode_text, so query vectors match the ones produced with the full model.
+    """
+    from open_clip import get_model_config
+    from open_clip.factory import load_state_dict
+    from open_clip.model import _build_text_tower
+    from open_clip.pretrained import get_pretrained_cfg, download_pretrained
+
+    model_cfg = get_model_config(CLIP_MODEL_NAME)
+    text_tower = _build_text_tower(
+        model_cfg["embed_dim"], model_cfg["text_cfg"], quick_gelu=model_cfg.get("quick_gelu", False)
+    )
+    checkpoint_path = download_pretrained(get_pretrained_cfg(CLIP_MODEL_NAME, CLIP_PRETRAINED))
+    state_dict = load_state_dict(checkpoint_path)
+    text_state = {
+        key: value for key, value in state_dict.items()
+        if not key.startswith("visual.") and key not in ("logit_scale", "logit_bias")
+    }
+    del state_dict
+    text_tower.load_state_dict(text_state, strict=True)
+    text_tower.encode_text = text_tower.forward
+    return text_tower
+
+
+def _create_clip():
+    import open_clip
+
+    clip_model = None
+    if CLIP_TEXT_ONLY:
+        try:
+            clip_model = _load_clip_text_tower()
+        except Exception as e:
+            print(f"⚠️ Could not load CLIP text tower only, falling back to the full model: {e}")
+    if clip_model is None:
+        clip_model, _, _ = open_clip.create_model_and_transforms(
+            CLIP_MODEL_NAME, pretrained=CLIP_PRETRAINED
+        )
+    clip_model.eval()
+    tokenizer = open_clip.get_tokenizer(CLIP_MODEL_NAME)
+    return clip_model, tokenizer
+
+
+def _create_vector_store():
+    # Backend is chosen with the VECTOR_STORE environment variable (qdrant or numpy).
+    return open_store(collection_name=COLLECTION_NAME)
+
+
+gemini_model = LazyResource("gemini", _create_gemini_model)
+text_model = LazyResource("e5", _create_text_model)
+clip = LazyResource("clip", _create_clip)
+vector_store = LazyResource("vector_store", _create_vector_store)
+text_reranker = LazyResource("text_reranker", CrossEncoderTextReranker)
+image_reranker = LazyResource("image_reranker", ClipImageReranker)
+
+RESOURCES = {
+    resource.name: resource
+    for resource in (gemini_model, text_model, clip, vector_store, text_reranker, image_reranker)
+}
+
+
+def warm_up(components=None):
+    """
+    Initialises the given components and returns their startup timings. By default that is all of
+    them, except the rerankers when RERANKING is off (the cross-encoder would be downloaded for nothing).
+    """
+    if components is None:
+        skipped = set() if RERANKING else {text_reranker.name, image_reranker.name}
+        components = [name for name in RESOURCES if name not in skipped]
+    for name in components:
+        RESOURCES[name].get()
+    timings = {name: STARTUP_TIMINGS[name] for name in components if name in STARTUP_TIMINGS}
+    for name, seconds in timings.items():
+        print(f"⏱️ {name} ready in {seconds:.2f}s")
+    return timings
+
+
+def encode_e5_queries(queries):
+    model = text_model.get()
+    return model.encode([f"query: {query}" for query in queries], batch_size=len(queries), normalize_embeddings=True)
+
+
+def encode_clip_queries(queries):
+    import torch
+
+    clip_model, tokenizer = clip.get()
+    with torch.no_grad():
+        text_features = clip_model.encode_text(tokenizer(list(queries)))
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    return text_features.cpu().numpy()
 
 
-qdrant = QdrantClient("http://localhost", port=6333)
+# Concurrent queries (app sessions, evaluation workers) share batched forward passes;
+# see batching.py for the window and batch size settings.
+e5_batcher = MicroBatcher("encode_e5", encode_e5_queries)
+clip_batcher = MicroBatcher("encode_clip", encode_clip_queries)
 
 
 def get_query_vector(query: str):
-    query = f"query: {query}"
-    return text_model.encode(query, normalize_embeddings=True)
+    # The stage includes the time spent waiting for the batch, i.e. the latency the query sees.
+    with stage("encode_e5"):
+        return e5_batcher.encode(query)
 
 
 def get_query_vector_clip(query: str):
-
-    tokenized = tokenizer([query])
-
-
-    with torch.no_grad():
-        text_features = clip_model.encode_text(tokenized)
-        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-
-    return text_features[0].cpu().numpy()
-def search_text(query_vector, top_k=10):
-    return qdrant.query_points(
-        collection_name="articles_collection",
-        query=query_vector.tolist(),
-        limit=top_k,
-        query_filter=rest.Filter(
-            must=[rest.FieldCondition(key="type", match=rest.MatchValue(value="text"))]
-        ),
-        with_payload=True
-    ).points
-
-
-def search_images(query_vector, top_k=10):
-    return qdrant.query_points(
-        collection_name="articles_collection",
-        query=query_vector.tolist(),
-        limit=top_k,
-        query_filter=rest.Filter(
-            must=[rest.FieldCondition(key="type", match=rest.MatchValue(value="image"))]
-        ),
-        with_payload=True
-    ).points
+    with stage("encode_clip"):
+        return clip_batcher.encode(query)
+
+
+def get_query_vectors(queries):
+    """
+    Encodes a whole list of queries with both encoders, submitted as one batch each.
+    Returns (e5 vectors, CLIP text vectors) as lists in query order.
+    """
+    text_futures = e5_batcher.submit_many(queries)
+    image_futures = clip_batcher.submit_many(queries)
+    return ([future.result() for future in text_futures],
+            [future.result() for future in image_futures])
+
+
+def collapse_by_article(text_hits, top_k):
+    """
+    Keeps only the best-scoring chunk of each article (hits are already sorted by score).
+    """
+    seen = set()
+    collapsed = []
+    for hit in text_hits:
+        article_id = hit.payload.get("article_id", hit.id)
+        if article_id in seen:
+            continue
+        seen.add(article_id)
+        collapsed.append(hit)
+        if len(collapsed) == top_k:
+            break
+    return collapsed
+
+
+def record_hits(modality, hits):
+    observe(f"{modality}_hits", len(hits), COUNT_BUCKETS, f"{modality.capitalize()} hits per search.")
+
+
+def search_text(query_vector, top_k=10, hnsw_ef=None, oversampling=None):
+    store = vector_store.get()
+    with stage("search_text"):
+        hits = store.search(TEXT_VECTOR, query_vector, "text", top_k * CHUNK_OVERSAMPLING,
+                            hnsw_ef=hnsw_ef, oversampling=oversampling)
+    hits = collapse_by_article(hits, top_k)
+    record_hits("text", hits)
+    return hits
+
+
+def search_images(query_vector, top_k=10, hnsw_ef=None, oversampling=None):
+    store = vector_store.get()
+    with stage("search_images"):
+        hits = store.search(IMAGE_VECTOR, query_vector, "image", top_k,
+                            hnsw_ef=hnsw_ef, oversampling=oversampling)
+    record_hits("image", hits)
+    return hits
+
+
+def search_multimodal(text_vector, image_vector, top_k=10, hnsw_ef=None, oversampling=None):
+    """
+    Searches the text and image vectors in a single batch (one query_batch_points
+    round-trip with Qdrant) and returns (text_hits, image_hits).
+
+    hnsw_ef and oversampling (for quantized collections) trade recall for latency per query;
+    None keeps the collection defaults.
+    """
+    store = vector_store.get()
+    with stage("search"):
+        text_hits, image_hits = store.search_batch([
+            SearchRequest(TEXT_VECTOR, text_vector, "text", top_k * CHUNK_OVERSAMPLING,
+                          hnsw_ef=hnsw_ef, oversampling=oversampling),
+            SearchRequest(IMAGE_VECTOR, image_vector, "image", top_k,
+                          hnsw_ef=hnsw_ef, oversampling=oversampling)
+        ])
+    text_hits = collapse_by_article(text_hits, top_k)
+    record_hits("text", text_hits)
+    record_hits("image", image_hits)
+    return text_hits, image_hits
+
+
+_retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+
+def retrieve(query, top_k=10, hnsw_ef=None, oversampling=None, vectors=None):
+    """
+    Runs the e5 and CLIP query encoders concurrently, then searches both modalities
+    in one batch request. Returns (text_hits, image_hits).
+    vectors is an already encoded (e5 vector, CLIP vector) pair, e.g. from get_query_vectors.
+    """
+    if vectors is not None:
+        return search_multimodal(vectors[0], vectors[1], top_k, hnsw_ef=hnsw_ef, oversampling=oversampling)
+    text_future = submit(_retrieval_executor, get_query_vector, query)
+    image_future = submit(_retrieval_executor, get_query_vector_clip, query)
+    return search_multimodal(text_future.result(), image_future.result(), top_k,
+                             hnsw_ef=hnsw_ef, oversampling=oversampling)
+
+
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_SPLIT_PATTERN.split(text) if sentence.strip()]
+
+
+def pack_text_context(query, text_hits, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Selects the most query-relevant sentences of each text hit so that all contents together
+    fit into token_budget tokens. Returns one packed content string per hit, in hit order.
+
+    Sentences are scored by e5 similarity to the query. Every hit first gets its best sentence
+    (in retrieval order) while the budget allows, the rest of the budget goes to the best
+    remaining sentences overall. Chosen sentences keep their original order, gaps become "…".
+    """
+    contents = [hit.payload.get("content", "") or "" for hit in text_hits]
+    if token_budget is None:
+        return contents
+
+    model = text_model.get()
+    with stage("pack_context"):
+        return _pack_sentences(model, query, text_hits, contents, token_budget)
+
+
+def _pack_sentences(model, query, text_hits, contents, token_budget):
+    sentences = [split_sentences(content)[:MAX_SENTENCES_PER_HIT] for content in contents]
+    flat = [(hit_idx, sent_idx, sentence)
+            for hit_idx, hit_sentences in enumerate(sentences)
+            for sent_idx, sentence in enumerate(hit_sentences)]
+    if not flat:
+        return contents
+
+    query_vector = model.encode(f"query: {query}", normalize_embeddings=True)
+    sentence_vectors = model.encode([f"passage: {sentence}" for _, _, sentence in flat],
+                                    normalize_embeddings=True, batch_size=64)
+    scores = sentence_vectors @ query_vector
+    lengths = [len(model.tokenizer.tokenize(sentence)) for _, _, sentence in flat]
+
+    by_score = sorted(range(len(flat)), key=lambda i: scores[i], reverse=True)
+    best_per_hit = {}
+    for i in by_score:
+        best_per_hit.setdefault(flat[i][0], i)
+
+    chosen, used = set(), 0
+    for i in [best_per_hit[hit_idx] for hit_idx in sorted(best_per_hit)] + by_score:
+        if i not in chosen and used + lengths[i] <= token_budget:
+            chosen.add(i)
+            used += lengths[i]
+
+    packed = [[] for _ in text_hits]
+    for i in sorted(chosen):
+        packed[flat[i][0]].append(flat[i][1:])
+
+    results = []
+    for hit_sentences, hit_chosen in zip(sentences, packed):
+        parts, previous = [], -1
+        for sent_idx, sentence in hit_chosen:
+            if sent_idx != previous + 1:
+                parts.append("…")
+            parts.append(sentence)
+            previous = sent_idx
+        if hit_chosen and previous != len(hit_sentences) - 1:
+            parts.append("…")
+        results.append(" ".join(parts) if parts else "[Content omitted]")
+    return results
 
 
 def load_image(path):
-    return Image.open(path)
+    # Downscaled rendition from the thumbnail store, attached to the prompt as a real image part.
+    return load_thumbnail(path)
 
 
-def build_multimodal_gemini_prompt(query, text_hits, image_hits):
+def build_multimodal_gemini_prompt(query, text_hits, image_hits, token_budget=CONTEXT_TOKEN_BUDGET):
     prompt = f"""
 You are a helpful multimodal assistant.
 
@@ -109,10 +362,35 @@ Ranked Image Results:
 2. [Image #N] — Title #N
 3. ...
 """
-    inputs = [prompt.strip()]
-    for i, hit in enumerate(text_hits):
+    return [prompt.strip()] + build_candidate_inputs(query, text_hits, image_hits, token_budget)
+
+
+def build_answer_prompt(query, text_hits, image_hits, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Prompt for already reranked hits: Gemini only writes the answer, the ranking is supplied locally.
+    """
+    prompt = f"""
+You are a helpful multimodal assistant.
+
+The user is searching for: "{query}"
+
+You are provided with the most relevant results retrieved from a database, already ranked by relevance:
+- text snippets (articles) with titles
+- images with titles.
+
+Answer the user's query **based on the retrieved content** (both texts and images). Do not make assumptions beyond the provided materials.
+
+Reply with the answer only, as a single paragraph without blank lines. Do not rank or list the results.
+"""
+    return [prompt.strip()] + build_candidate_inputs(query, text_hits, image_hits, token_budget)
+
+
+def build_candidate_inputs(query, text_hits, image_hits, token_budget=CONTEXT_TOKEN_BUDGET):
+    inputs = []
+    contents = pack_text_context(query, text_hits, token_budget)
+    for i, (hit, text) in enumerate(zip(text_hits, contents)):
         title = hit.payload.get("title", "No title")
-        text = hit.payload.get("content", "No content")
+        text = text or "No content"
         combined = f"Text #{i + 1}:\nTitle: {title}\nContent: {text}"
         inputs.append(combined)
 
@@ -120,31 +398,250 @@ Ranked Image Results:
         caption = hit.payload.get("title", "No title")
         image_path = hit.payload.get("image_path")
         if image_path and os.path.exists(image_path):
-            img = load_image(image_path)
-            inputs.append(f"Image #{i + 1}:\nTitle: {caption}\nImage: {img}")
+            inputs.append(f"Image #{i + 1}:\nTitle: {caption}\nImage:")
+            with stage("load_image"):
+                inputs.append(load_image(image_path))
         else:
             inputs.append(f"Image #{i + 1}: [Missing image at {image_path}]")
     return inputs
 
 
-def query_gemini_multimodal(query):
-    q_vec_text = get_query_vector(query)
-    q_vec_image = get_query_vector_clip(query)
-    text_hits = search_text(q_vec_text)
-    image_hits = search_images(q_vec_image)
-
-    gemini_input = build_multimodal_gemini_prompt(query, text_hits, image_hits)
-    response = model.generate_content(gemini_input, stream=False)
-    return response.text, text_hits, image_hits
+answer_cache = AnswerCache(similarity_threshold=ANSWER_CACHE_SIMILARITY)
+_collection_version = {"value": None, "checked": None}
+_collection_version_lock = threading.Lock()
+
+
+def collection_version():
+    """
+    Cheap fingerprint of the collection contents (point count + ingest manifest mtime),
+    re-read from the vector store at most every CACHE_VERSION_CHECK_INTERVAL seconds.
+    """
+    with _collection_version_lock:
+        now = time.monotonic()
+        checked = _collection_version["checked"]
+        if checked is None or now - checked > CACHE_VERSION_CHECK_INTERVAL:
+            store = vector_store.get()
+            with stage("collection_version"):
+                points_count = store.count()
+            manifest_mtime = os.path.getmtime(INGEST_MANIFEST_PATH) if os.path.exists(INGEST_MANIFEST_PATH) else None
+            _collection_version["value"] = (points_count, manifest_mtime)
+            _collection_version["checked"] = now
+        return _collection_version["value"]
+
+
+def cached_retrieve(query, cache=answer_cache, top_k=10):
+    """
+    Looks the query up in the answer cache before retrieving.
+
+    Returns (cached, similar_query, text_vector, text_hits, image_hits). On a cache hit, cached is
+    the stored (gemini_output, text_hits, image_hits) tuple, similar_query is the other query whose
+    answer is reused on a semantic hit (None on an exact hit) and the remaining values are None.
+    On a miss, cached is None and the e5 query vector is returned so the answer can be stored with cache.put.
+    """
+    cache.validate(collection_version())
+    cached = cache.get_exact(query)
+    if cached is not None:
+        count("cache_lookups", help_text="Answer cache lookups by result.", result="exact")
+        return cached, None, None, None, None
+
+    # CLIP runs in the background while the e5 vector is checked against the semantic tier.
+    image_future = submit(_retrieval_executor, get_query_vector_clip, query)
+    text_vector = get_query_vector(query)
+    similar = cache.get_similar(text_vector)
+    if similar is not None:
+        image_future.cancel()
+        count("cache_lookups", help_text="Answer cache lookups by result.", result="semantic")
+        cached, similar_query = similar
+        return cached, similar_query, None, None, None
+
+    count("cache_lookups", help_text="Answer cache lookups by result.", result="miss")
+    text_hits, image_hits = search_multimodal(text_vector, image_future.result(), top_k)
+    return None, None, text_vector, text_hits, image_hits
+
+
+def format_ranked_results(text_hits, image_hits):
+    lines = ["Ranked Text Results:"]
+    lines += [f"{i + 1}. [Text #{i + 1}] — {hit.payload.get('title', 'No title')}" for i, hit in enumerate(text_hits)]
+    lines += ["", "Ranked Image Results:"]
+    lines += [f"{i + 1}. [Image #{i + 1}] — {hit.payload.get('title', 'No title')}" for i, hit in enumerate(image_hits)]
+    return "\n".join(lines)
+
+
+def prepare_generation(query, text_hits, image_hits):
+    """
+    Returns (text_hits, image_hits, gemini_input, prefix, suffix). The Gemini output wrapped in
+    prefix and suffix always has the layout parse_gemini_output expects: with reranking, the hits
+    are reordered and trimmed locally, Gemini only writes the answer and the ranking is appended.
+    """
+    if not RERANKING:
+        gemini_input = build_multimodal_gemini_prompt(query, text_hits, image_hits)
+        record_prompt(gemini_input)
+        return text_hits, image_hits, gemini_input, "", ""
+
+    text_ranker, image_ranker = text_reranker.get(), image_reranker.get()
+    with stage("rerank"):
+        text_hits = rerank(text_ranker, query, text_hits, RERANK_TEXT_TOP_K)
+        image_hits = rerank(image_ranker, query, image_hits, RERANK_IMAGE_TOP_K)
+    gemini_input = build_answer_prompt(query, text_hits, image_hits)
+    record_prompt(gemini_input)
+    return text_hits, image_hits, gemini_input, ANSWER_MARKER, "\n\n" + format_ranked_results(text_hits, image_hits)
+
+
+def record_prompt(gemini_input):
+    observe("prompt_chars", sum(len(part) for part in gemini_input if isinstance(part, str)),
+            help_text="Characters of text sent to Gemini per prompt.")
+    observe("prompt_images", sum(1 for part in gemini_input if not isinstance(part, str)), COUNT_BUCKETS,
+            help_text="Images attached to each Gemini prompt.")
+
+
+def query_gemini_multimodal(query, use_cache=True):
+    if not use_cache:
+        text_hits, image_hits = retrieve(query)
+    else:
+        cached, _, text_vector, text_hits, image_hits = cached_retrieve(query)
+        if cached is not None:
+            return cached
+
+    text_hits, image_hits, gemini_input, prefix, suffix = prepare_generation(query, text_hits, image_hits)
+    model = gemini_model.get()
+    with stage("gemini"):
+        response = model.generate_content(gemini_input, stream=False)
+    result = (prefix + response.text + suffix, text_hits, image_hits)
+    if use_cache:
+        answer_cache.put(query, text_vector, result)
+    return result
+
+
+def stream_gemini_multimodal(query, use_cache=True):
+    """
+    Like query_gemini_multimodal, but returns as soon as retrieval is done.
+    Returns (chunks, text_hits, image_hits, similar_query) where chunks yields the Gemini output as
+    it is generated. A cached answer is returned as a single chunk; a fresh one is cached once fully
+    streamed. similar_query is set when the answer was reused from a different (similar) question.
+    """
+    if not use_cache:
+        text_hits, image_hits = retrieve(query)
+    else:
+        cached, similar_query, text_vector, text_hits, image_hits = cached_retrieve(query)
+        if cached is not None:
+            gemini_output, text_hits, image_hits = cached
+            return iter([gemini_output]), text_hits, image_hits, similar_query
+
+    text_hits, image_hits, gemini_input, prefix, suffix = prepare_generation(query, text_hits, image_hits)
+    model = gemini_model.get()
+    start = time.perf_counter()
+    response = model.generate_content(gemini_input, stream=True)
+
+    def chunks():
+        # Timed while consumed, so the stages land in the trace that iterates the chunks.
+        parts = [prefix] if prefix else []
+        first_chunk = True
+        if prefix:
+            yield prefix
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. only safety metadata) raise on .text.
+                continue
+            if text:
+                if first_chunk:
+                    observe_stage("gemini_first_chunk", time.perf_counter() - start)
+                    first_chunk = False
+                parts.append(text)
+                yield text
+        observe_stage("gemini", time.perf_counter() - start)
+        if suffix:
+            parts.append(suffix)
+            yield suffix
+        if use_cache:
+            answer_cache.put(query, text_vector, ("".join(parts), text_hits, image_hits))
+
+    return chunks(), text_hits, image_hits, None
+
+
+ANSWER_PATTERN = re.compile(r"Answer:\n(.+?)\n\n", re.DOTALL)
+RANKED_TEXT_PATTERN = re.compile(r"\d+\.\s+\[Text\s+#(\d+)]\s+—\s+(.*)")
+RANKED_IMAGE_PATTERN = re.compile(r"\d+\.\s+\[Image\s+#(\d+)]\s+—\s+(.*)")
+ANSWER_MARKER = "Answer:\n"
+
+
+class StreamingGeminiParser:
+    """
+    Incremental counterpart of parse_gemini_output for streamed Gemini chunks.
+
+    feed() returns the newly available part of the answer, so it can be rendered as it arrives,
+    and updates ranked_text / ranked_images from every completed line. finish() returns the same
+    (answer, ranked_text, ranked_images) tuple as parse_gemini_output on the full text.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.ranked_text = []
+        self.ranked_images = []
+        self._answer_start = None
+        self._answer_end = None
+        self._emitted = 0
+        self._parsed_upto = 0
+
+    def feed(self, chunk):
+        self.text += chunk
+        self._parse_complete_lines()
+        return self._answer_delta()
+
+    def stream_answer(self, chunks):
+        for chunk in chunks:
+            delta = self.feed(chunk)
+            if delta:
+                yield delta
+
+    def finish(self):
+        return parse_gemini_output(self.text)
+
+    def _answer_delta(self):
+        if self._answer_start is None:
+            marker = self.text.find(ANSWER_MARKER)
+            if marker < 0:
+                return ""
+            self._answer_start = self._emitted = marker + len(ANSWER_MARKER)
+        if self._answer_end is None:
+            end = self.text.find("\n\n", self._answer_start)
+            if end >= 0:
+                self._answer_end = end
+        # Hold back trailing newlines until we know whether they end the answer.
+        limit = self._answer_end if self._answer_end is not None else len(self.text.rstrip("\n"))
+        if limit <= self._emitted:
+            return ""
+        delta = self.text[self._emitted:limit]
+        self._emitted = limit
+        return delta
+
+    def _parse_complete_lines(self):
+        last_newline = self.text.rfind("\n")
+        if last_newline < self._parsed_upto:
+            return
+        for line in self.text[self._parsed_upto:last_newline].split("\n"):
+            text_match = RANKED_TEXT_PATTERN.search(line)
+            if text_match:
+                self.ranked_text.append(int(text_match.group(1)) - 1)
+            image_match = RANKED_IMAGE_PATTERN.search(line)
+            if image_match:
+                self.ranked_images.append(int(image_match.group(1)) - 1)
+        self._parsed_upto = last_newline + 1
 
 
 def parse_gemini_output(gemini_output):
-    answer_match = re.search(r"Answer:\n(.+?)\n\n", gemini_output, re.DOTALL)
-    text_matches = re.findall(r"\d+\.\s+\[Text\s+#(\d+)]\s+—\s+(.*)", gemini_output)
-    image_matches = re.findall(r"\d+\.\s+\[Image\s+#(\d+)]\s+—\s+(.*)", gemini_output)
+    with stage("parse"):
+        return _parse_gemini_output(gemini_output)
+
+
+def _parse_gemini_output(gemini_output):
+    answer_match = ANSWER_PATTERN.search(gemini_output)
+    text_matches = RANKED_TEXT_PATTERN.findall(gemini_output)
+    image_matches = RANKED_IMAGE_PATTERN.findall(gemini_output)
 
     answer = answer_match.group(1).strip() if answer_match else "[No answer found]"
     ranked_text = [(int(idx) - 1) for idx, title in text_matches]
     ranked_images = [(int(idx) - 1) for idx, title in image_matches]
 
-    return answer, ranked_text, ranked_images
\ No newline at end of file
+    return answer, ranked_text, ranked_images
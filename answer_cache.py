@@ -0,0 +1,107 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.strip(" ?!.")
+
+
+class AnswerCache:
+    """
+    Two-tier LRU/TTL cache for answered queries.
+
+    The exact tier is keyed by the normalized query text. The optional semantic tier returns the
+    value of the most similar cached query when the cosine similarity of the (normalized) query
+    vectors is at least similarity_threshold. It is off by default (similarity_threshold=None):
+    e5 vectors of different questions ("What is RL?" / "What is RLHF?") are often above 0.95.
+    The whole cache is dropped whenever validate() sees a new collection version.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry["created"] > self.ttl
+
+    def _evict_expired(self, now):
+        for key in [key for key, entry in self._entries.items() if self._expired(entry, now)]:
+            del self._entries[key]
+
+    def validate(self, version):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_exact(self, query):
+        """Looks the query up in the exact tier. A miss here is not counted until get_similar()."""
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry, time.time()):
+                # Dropped here so dead entries do not count against max_entries.
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry["value"]
+
+    def get_similar(self, vector):
+        """Returns (value, cached query) for the most similar cached query above the threshold, else None."""
+        with self._lock:
+            now = time.time()
+            self._evict_expired(now)
+            candidates = [(key, entry) for key, entry in self._entries.items() if entry["vector"] is not None]
+            if self.similarity_threshold is None or vector is None or not candidates:
+                self.misses += 1
+                return None
+
+            matrix = np.stack([entry["vector"] for _, entry in candidates])
+            similarities = matrix @ np.asarray(vector, dtype=matrix.dtype)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+            self.semantic_hits += 1
+            return entry["value"], entry["query"]
+
+    def put(self, query, vector, value):
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = {"query": query, "vector": vector, "value": value, "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -1,97 +1,169 @@
 import streamlit as st
-from LLM_search import query_gemini_multimodal, parse_gemini_output
+from LLM_search import parse_gemini_output, stream_gemini_multimodal, StreamingGeminiParser, warm_up, answer_cache
 import os
-from PIL import Image
+from metrics import trace, start_metrics_server
+from thumbnails import resolve_thumbnail
+
+CARD_STYLE = """
+<style>
+.scrollable-container {
+    max-height: 400px;
+    overflow-y: auto;
+    padding-right: 10px;
+}
+.card-title {
+    font-weight: bold;
+    color: white !important;
+    text-decoration: none;
+    font-size: 16px;
+}
+.card-title:hover {
+    text-decoration: underline;
+}
+.card-snippet {
+    color: white;
+    margin-top: 6px;
+}
+.card-container {
+    border: 1px solid #444;
+    border-radius: 8px;
+    padding: 12px;
+    margin-bottom: 10px;
+    box-shadow: 2px 2px 5px rgba(0,0,0,0.5);
+    background-color: #222; /* темний фон для контрасту */
+}
+</style>
+"""
+
+
+def render_text_cards(text_hits, order):
+    st.markdown("### 📑 Relevant Articles")
+    st.markdown(CARD_STYLE, unsafe_allow_html=True)
+    st.markdown('<div class="scrollable-container">', unsafe_allow_html=True)
+
+    for idx in order:
+        if not 0 <= idx < len(text_hits):
+            continue
+        hit = text_hits[idx]
+        title = hit.payload.get("title", " ")
+        link = hit.payload.get("url", "#")
+        content = hit.payload.get("content", "")
+        snippet = content[:100] + ("..." if len(content) > 100 else "")
+
+        card_html = f"""
+        <div class="card-container">
+            <a href="{link}" target="_blank" class="card-title">{title}</a>
+            <p class="card-snippet">{snippet}</p>
+        </div>
+        """
+        st.markdown(card_html, unsafe_allow_html=True)
 
-def display_multimodal_ui(gemini_output, text_hits, image_hits):
-    answer, ranked_text, ranked_images = parse_gemini_output(gemini_output)
+    st.markdown('</div>', unsafe_allow_html=True)
 
-    col1, col2, col3 = st.columns([1.2, 2.5, 1.5])
 
-    with col1:
-        st.markdown("### 📑 Relevant Articles")
-
-        scrollable_style = """
-        <style>
-        .scrollable-container {
-            max-height: 400px;
-            overflow-y: auto;
-            padding-right: 10px;
-        }
-        .card-title {
-            font-weight: bold;
-            color: white !important;
-            text-decoration: none;
-            font-size: 16px;
-        }
-        .card-title:hover {
-            text-decoration: underline;
-        }
-        .card-snippet {
-            color: white;
-            margin-top: 6px;
-        }
-        .card-container {
-            border: 1px solid #444;
-            border-radius: 8px;
-            padding: 12px;
-            margin-bottom: 10px;
-            box-shadow: 2px 2px 5px rgba(0,0,0,0.5);
-            background-color: #222; /* темний фон для контрасту */
-        }
-        </style>
-        """
+def render_images(image_hits, order):
+    st.markdown("### 🖼️ Relevant Images")
+    order = [idx for idx in order if 0 <= idx < len(image_hits)]
+    for i in range(0, len(order), 3):
+        row_images = order[i:i+3]
+        cols = st.columns(len(row_images))
+
+        for col, idx in zip(cols, row_images):
+            hit = image_hits[idx]
+            title = hit.payload.get("title")
+            img_path = hit.payload.get("image_path")
 
-        st.markdown(scrollable_style, unsafe_allow_html=True)
-        st.markdown('<div class="scrollable-container">', unsafe_allow_html=True)
+            with col:
+                if img_path and os.path.exists(img_path):
+                    st.image(resolve_thumbnail(img_path), caption=title, use_container_width=True)
+                else:
+                    st.warning(f"Image not found: {img_path}")
 
-        for idx in ranked_text:
-            hit = text_hits[idx]
-            title = hit.payload.get("title", " ")
-            link = hit.payload.get("url", "#")
-            content = hit.payload.get("content", "")
-            snippet = content[:100] + ("..." if len(content) > 100 else "")
 
-            card_html = f"""
-            <div class="card-container">
-                <a href="{link}" target="_blank" class="card-title">{title}</a>
-                <p class="card-snippet">{snippet}</p>
-            </div>
-            """
-            st.markdown(card_html, unsafe_allow_html=True)
+def display_multimodal_ui(gemini_output, text_hits, image_hits):
+    answer, ranked_text, ranked_images = parse_gemini_output(gemini_output)
+
+    col1, col2, col3 = st.columns([1.2, 2.5, 1.5])
 
-        st.markdown('</div>', unsafe_allow_html=True)
+    with col1:
+        render_text_cards(text_hits, ranked_text)
 
     with col2:
         st.markdown("## 💬 Answer")
         st.write(answer)
 
     with col3:
-        st.markdown("### 🖼️ Relevant Images")
-        for i in range(0, len(ranked_images), 3):
-            row_images = ranked_images[i:i+3]
-            cols = st.columns(len(row_images))
+        render_images(image_hits, ranked_images)
 
-            for col, idx in zip(cols, row_images):
-                hit = image_hits[idx]
-                title = hit.payload.get("title")
-                img_path = hit.payload.get("image_path")
-
-                with col:
-                    if img_path and os.path.exists(img_path):
-                        st.image(Image.open(img_path), caption=title, use_container_width=True)
-                    else:
-                        st.warning(f"Image not found: {img_path}")
 
+def display_streaming_ui(chunks, text_hits, image_hits):
+    """
+    Shows the retrieved cards in retrieval order straight away, streams the answer as Gemini
+    generates it, then re-renders the cards in Gemini's ranked order.
+    """
+    col1, col2, col3 = st.columns([1.2, 2.5, 1.5])
+    text_slot = col1.empty()
+    image_slot = col3.empty()
 
+    with text_slot.container():
+        render_text_cards(text_hits, range(len(text_hits)))
+    with image_slot.container():
+        render_images(image_hits, range(len(image_hits)))
 
+    parser = StreamingGeminiParser()
+    with col2:
+        st.markdown("## 💬 Answer")
+        streamed = st.write_stream(parser.stream_answer(chunks))
+
+    answer, ranked_text, ranked_images = parser.finish()
+    if not streamed:
+        # Nothing followed an "Answer:" marker while streaming, so show what the full output parses to.
+        with col2:
+            st.markdown(answer)
+    if ranked_text:
+        with text_slot.container():
+            render_text_cards(text_hits, ranked_text)
+    if ranked_images:
+        with image_slot.container():
+            render_images(image_hits, ranked_images)
+
+
+def render_timings(query_trace):
+    breakdown = query_trace.breakdown()
+    rows = [{"stage": name, "ms": round(seconds * 1000, 1)} for name, seconds in breakdown.items()]
+    rows.append({"stage": "total", "ms": round(query_trace.total_seconds * 1000, 1)})
+    with st.expander("⏱️ Query timings"):
+        st.caption("Encoders run concurrently, so stages can add up to more than the total.")
+        st.table(rows)
+        if query_trace.values:
+            st.json(query_trace.values)
+
+
+@st.cache_resource(show_spinner="Loading models...")
+def load_components():
+    start_metrics_server()
+    return warm_up()
 
 
 st.set_page_config(page_title="Multimodal RAG UI", layout="wide")
 st.title("🔍 Multimodal Search Assistant (Text + Image)")
+
+startup_timings = load_components()
+with st.sidebar.expander("⏱️ Startup timings"):
+    for name, seconds in startup_timings.items():
+        st.write(f"{name}: {seconds:.2f}s")
+
 query = st.text_input("Enter your query:")
 
 if query:
-    with st.spinner("Searching and generating response..."):
-        gemini_output, text_hits, image_hits = query_gemini_multimodal(query)
-        display_multimodal_ui(gemini_output, text_hits, image_hits)
\ No newline at end of file
+    # The chunks are consumed inside the trace, so Gemini and parsing are part of the breakdown.
+    with trace("query", query=query) as query_trace:
+        with st.spinner("Searching..."):
+            chunks, text_hits, image_hits, similar_query = stream_gemini_multimodal(query)
+        if similar_query:
+            st.info(f"♻️ Answer reused from a similar question: “{similar_query}”")
+        display_streaming_ui(chunks, text_hits, image_hits)
+    render_timings(query_trace)
+
+with st.sidebar.expander("🗃️ Answer cache"):
+    st.json(answer_cache.stats())
\ No newline at end of file
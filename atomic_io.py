@@ -0,0 +1,22 @@
+import os
+
+TMP_SUFFIX = ".tmp"
+
+
+def atomic_write(path, content, mode="w", suffix=TMP_SUFFIX):
+    """
+    Writes path through a temporary sibling (path + suffix) and os.replace, so readers see either
+    the previous file or the complete new one. content is the str / bytes to write, or a callable
+    that writes to the open temporary file. A failed write leaves the temporary file behind and
+    path untouched.
+    """
+    path = os.fspath(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + suffix
+    with open(tmp_path, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        if callable(content):
+            content(f)
+        else:
+            f.write(content)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,90 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from metrics import stage, observe, COUNT_BUCKETS
+
+# How long the first request of a batch waits for others to join it, and the largest batch per forward pass.
+ENCODER_BATCH_WAIT_MS = float(os.getenv("ENCODER_BATCH_WAIT_MS", "5"))
+ENCODER_MAX_BATCH_SIZE = int(os.getenv("ENCODER_MAX_BATCH_SIZE", "32"))
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching in front of a batch encoder. Concurrent callers enqueue single inputs;
+    one worker thread takes the first waiting input, collects whatever else arrives within
+    max_wait_ms (up to max_batch_size inputs), runs encode_batch once and hands every caller
+    its own row of the result.
+
+    encode_batch takes a list of inputs and returns one vector per input, in order.
+    """
+
+    def __init__(self, name, encode_batch, max_batch_size=ENCODER_MAX_BATCH_SIZE, max_wait_ms=ENCODER_BATCH_WAIT_MS):
+        self.name = name
+        self.encode_batch = encode_batch
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max(max_wait_ms, 0) / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+                    self._worker.start()
+
+    def submit(self, item):
+        """Enqueues one input and returns a Future for its vector."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit_many(self, items):
+        """Enqueues a whole list at once; the worker encodes it in batches of up to max_batch_size."""
+        self._ensure_worker()
+        futures = [Future() for _ in items]
+        for item, future in zip(items, futures):
+            self._queue.put((item, future))
+        return futures
+
+    def encode(self, item):
+        return self.submit(item).result()
+
+    def encode_many(self, items):
+        return [future.result() for future in self.submit_many(items)]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        # Callers that cancelled their future while it was queued are dropped.
+        return [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            observe(f"{self.name}_batch_size", len(batch), COUNT_BUCKETS, "Inputs per batched encoder forward pass.")
+            try:
+                with stage(f"{self.name}_batch"):
+                    vectors = self.encode_batch([item for item, _ in batch])
+                if len(vectors) != len(batch):
+                    # zip() would silently leave the unmatched callers waiting forever.
+                    raise ValueError(f"{self.name} encoder returned {len(vectors)} vectors for {len(batch)} inputs")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
@@ -0,0 +1,556 @@
+import os
+import json
+import time
+import zlib
+import argparse
+import tempfile
+import itertools
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from metrics import latency_summary
+from vector_store import (Point, SearchRequest, QdrantStore, NumpyStore, get_qdrant_pool,
+                          QDRANT_URL, QDRANT_PORT, QDRANT_GRPC_PORT)
+
+WORDS = ("model data training agent robot vision language image benchmark chip policy research "
+         "startup dataset inference network learning safety cloud health").split()
+
+
+def synthetic_vectors(n, dim, seed=0, clusters=64):
+    """
+    Normalised vectors drawn around a set of random centres, so nearest neighbours are meaningful.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def noisy_queries(corpus, n, seed=1, noise=0.3):
+    rng = np.random.default_rng(seed)
+    queries = corpus[rng.integers(0, len(corpus), n)] + noise * rng.normal(size=(n, corpus.shape[1])).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_top_k(corpus, queries, k):
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+
+def write_results(results, output=None):
+    lines = [json.dumps(result) for result in results]
+    for line in lines:
+        print(line)
+    if output:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def wait_until_indexed(client, collection_name, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if str(client.get_collection(collection_name).status).endswith("green"):
+            return
+        time.sleep(0.5)
+    raise TimeoutError(f"Collection {collection_name} was not indexed within {timeout}s")
+
+
+def load_collection_vectors(client, collection_name, vector_name, limit=None):
+    vectors = []
+    offset = None
+    while limit is None or len(vectors) < limit:
+        records, offset = client.scroll(
+            collection_name=collection_name, limit=256, offset=offset, with_vectors=[vector_name]
+        )
+        vectors.extend(record.vector[vector_name] for record in records if vector_name in (record.vector or {}))
+        if offset is None:
+            break
+    vectors = np.asarray(vectors[:limit], dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def estimated_ram_bytes(n, dim, quantization, on_disk, hnsw_m):
+    """
+    Rough resident size of the vector data: originals (unless on disk), quantized copies
+    (always kept in RAM) and the HNSW links. Qdrant does not report per-collection memory.
+    """
+    original = 0 if on_disk else n * dim * 4
+    quantized = {None: 0, "int8": n * dim, "binary": n * dim // 8}[quantization]
+    graph = n * (hnsw_m or 16) * 2 * 4
+    return original + quantized + graph
+
+
+def _seeded_vector(key, dim):
+    vector = np.random.default_rng(zlib.crc32(key.encode("utf-8"))).normal(size=dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class StubTextModel:
+    """
+    Stand-in for the e5 SentenceTransformer: deterministic hash-seeded vectors, whitespace tokenizer.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.tokenizer = SimpleNamespace(tokenize=str.split)
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, convert_to_tensor=False):
+        single = isinstance(sentences, str)
+        vectors = np.stack([_seeded_vector(s, self.dim) for s in ([sentences] if single else sentences)])
+        if convert_to_tensor:
+            import torch
+            vectors = torch.from_numpy(vectors)
+        return vectors[0] if single else vectors
+
+
+class StubClipModel:
+    """
+    Stand-in for CLIP with the same encode_text / encode_image interface: token ids and
+    4x4-pooled pixels are projected with fixed random matrices.
+    """
+
+    def __init__(self, dim, vocab_size=4096):
+        import torch
+        generator = torch.Generator().manual_seed(0)
+        self.token_embedding = torch.randn(vocab_size, dim, generator=generator)
+        self.pixel_projection = torch.randn(3 * 4 * 4, dim, generator=generator)
+        self.vocab_size = vocab_size
+
+    def eval(self):
+        return self
+
+    def tokenize(self, texts):
+        import torch
+        return torch.tensor([
+            [zlib.crc32(word.encode("utf-8")) % self.vocab_size for word in (text.split() or [""])[:16]]
+            + [0] * (16 - len((text.split() or [""])[:16]))
+            for text in texts
+        ])
+
+    def encode_text(self, tokens):
+        return self.token_embedding[tokens].mean(dim=1)
+
+    def encode_image(self, images):
+        import torch.nn.functional as F
+        return F.adaptive_avg_pool2d(images, 4).flatten(1) @ self.pixel_projection
+
+
+def stub_preprocess(image):
+    import torch
+    pixels = np.asarray(image.resize((32, 32)), dtype=np.float32) / 255.0
+    return torch.from_numpy(pixels).permute(2, 0, 1)
+
+
+class FakeGeminiModel:
+    """
+    Returns a canned answer. For the full prompt (no local reranking) it also ranks every candidate
+    in reverse order; for build_answer_prompt, which asks for the answer only, it returns just that.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def generate_content(self, inputs, stream=False):
+        texts = [part for part in inputs if isinstance(part, str)]
+        n_text = sum(part.startswith("Text #") for part in texts)
+        n_image = sum(part.startswith("Image #") for part in texts)
+        answer = "A canned answer built from the retrieved material."
+        if texts and "Ranked Text Results:" not in texts[0]:
+            # prepare_generation adds the "Answer:" marker and the ranked lists around this reply.
+            text = answer
+        else:
+            lines = ["Answer:", answer, "", "Ranked Text Results:"]
+            lines += [f"{rank}. [Text #{n}] — Title #{n}" for rank, n in enumerate(range(n_text, 0, -1), 1)]
+            lines += ["", "Ranked Image Results:"]
+            lines += [f"{rank}. [Image #{n}] — Title #{n}" for rank, n in enumerate(range(n_image, 0, -1), 1)]
+            text = "\n".join(lines)
+        if self.latency:
+            time.sleep(self.latency)
+        if stream:
+            return [SimpleNamespace(text=text[i:i + 32]) for i in range(0, len(text), 32)]
+        return SimpleNamespace(text=text)
+
+
+def synthetic_article(i, rng, words_per_article=400):
+    content = " ".join(
+        " ".join(rng.choice(WORDS, size=12)).capitalize() + "."
+        for _ in range(words_per_article // 12)
+    )
+    return {"url": f"https://example.com/article-{i}", "title": f"Article {i}", "content": content}
+
+
+def make_store(backend, collection_name, workdir):
+    if backend == "numpy":
+        return NumpyStore(path=workdir, collection_name=collection_name)
+    from qdrant_client import QdrantClient
+    return QdrantStore(client=QdrantClient(":memory:"), collection_name=collection_name)
+
+
+def seed_store(store, corpus_size, dim, chunks_per_article=3, images_per_article=2, seed=0):
+    """
+    Fills the store with synthetic text chunks and image points shaped like ingest_data's output.
+    """
+    rng = np.random.default_rng(seed)
+    store.create_collection({"text": dim, "image": dim})
+    # Ids keep counting across upsert batches; restarting them would overwrite earlier points.
+    point_ids = itertools.count()
+    points = []
+    for i in range(corpus_size):
+        article = synthetic_article(i, rng, words_per_article=chunks_per_article * 60)
+        article_id = f"00000000-0000-0000-0000-{i:012d}"
+        for chunk_index in range(chunks_per_article):
+            points.append(Point(next(point_ids), {"text": rng.normal(size=dim)}, {
+                "url": article["url"], "title": article["title"], "type": "text",
+                "content": " ".join(article["content"].split()[chunk_index * 60:(chunk_index + 1) * 60]),
+                "article_id": article_id, "chunk_index": chunk_index, "chunk_count": chunks_per_article
+            }))
+        for image_index in range(images_per_article):
+            points.append(Point(next(point_ids), {"image": rng.normal(size=dim)}, {
+                "title": article["title"], "type": "image", "image_path": f"missing/{i}-{image_index}.jpg"
+            }))
+        if len(points) >= 512:
+            store.upsert(points)
+            points = []
+    if points:
+        store.upsert(points)
+    store.flush()
+    expected = corpus_size * (chunks_per_article + images_per_article)
+    assert store.count() == expected, f"seeded {store.count()} points, expected {expected}"
+
+
+def install_stubs(dim, gemini_latency=0.0, store=None):
+    import LLM_search
+    from reranker import StubReranker, ClipImageReranker
+
+    clip_model = StubClipModel(dim)
+    LLM_search.text_model.set(StubTextModel(dim))
+    LLM_search.clip.set((clip_model, clip_model.tokenize))
+    LLM_search.gemini_model.set(FakeGeminiModel(gemini_latency))
+    LLM_search.text_reranker.set(StubReranker())
+    LLM_search.image_reranker.set(ClipImageReranker())
+    if store is not None:
+        LLM_search.vector_store.set(store)
+    return LLM_search
+
+
+def _timed(stage_latencies, stage, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    stage_latencies.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def bench_pipeline(args):
+    rng = np.random.default_rng(args.seed)
+    queries = [" ".join(rng.choice(WORDS, size=5)) for _ in range(args.queries)]
+    results = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for corpus_size in args.corpus_sizes:
+            store = make_store(args.backend, f"bench_pipeline_{corpus_size}", workdir)
+            seed_store(store, corpus_size, args.dim, seed=args.seed)
+            search = install_stubs(args.dim, args.gemini_latency, store)
+
+            stages = {}
+            for query in queries:
+                text_vector = _timed(stages, "encode_text", search.get_query_vector, query)
+                image_vector = _timed(stages, "encode_clip", search.get_query_vector_clip, query)
+                text_hits, image_hits = _timed(stages, "search", search.search_multimodal,
+                                               text_vector, image_vector, args.top_k)
+                text_hits, image_hits, gemini_input, prefix, suffix = _timed(
+                    stages, "prepare_prompt", search.prepare_generation, query, text_hits, image_hits
+                )
+                response = _timed(stages, "gemini", search.gemini_model.get().generate_content, gemini_input)
+                _, ranked_text, ranked_images = _timed(stages, "parse", search.parse_gemini_output,
+                                                       prefix + response.text + suffix)
+                # The parse stage must time the layout production sees, with every hit ranked once.
+                assert len(set(ranked_text)) == len(ranked_text) and len(set(ranked_images)) == len(ranked_images), \
+                    f"malformed benchmark response: {ranked_text} / {ranked_images}"
+
+            for concurrency in args.concurrency:
+                latencies = []
+
+                def run(query):
+                    start = time.perf_counter()
+                    search.query_gemini_multimodal(query, use_cache=False)
+                    latencies.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    list(executor.map(run, queries))
+                wall = time.perf_counter() - start
+
+                results.append({
+                    "benchmark": "pipeline",
+                    "backend": args.backend,
+                    "corpus_size": corpus_size,
+                    "dim": args.dim,
+                    "concurrency": concurrency,
+                    "queries": len(queries),
+                    "reranking": search.RERANKING,
+                    "qps": round(len(queries) / wall, 2),
+                    "end_to_end": latency_summary(latencies),
+                    "stages": {stage: latency_summary(values) for stage, values in stages.items()}
+                })
+
+    write_results(results, args.output)
+
+
+def bench_ingest(args):
+    from PIL import Image
+    import ingest_data
+    from corpus import write_corpus
+
+    rng = np.random.default_rng(args.seed)
+    clip_model = StubClipModel(args.dim)
+    ingest_data.text_model.set(StubTextModel(args.dim))
+    ingest_data.clip.set((clip_model, stub_preprocess))
+    results = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        media_folder = os.path.join(workdir, "media")
+        os.makedirs(media_folder)
+        for corpus_size in args.corpus_sizes:
+            rows = []
+            for i in range(corpus_size):
+                article = synthetic_article(i, rng)
+                paths = []
+                for image_index in range(args.images_per_article):
+                    path = os.path.join(media_folder, f"{corpus_size}-{i}-{image_index}.jpg")
+                    pixels = rng.integers(0, 255, size=(args.image_size, args.image_size, 3), dtype=np.uint8)
+                    Image.fromarray(pixels).save(path, quality=85)
+                    paths.append(path)
+                rows.append({**article, "media_urls": paths})
+            corpus_path = os.path.join(workdir, f"corpus-{corpus_size}.parquet")
+            write_corpus(rows, corpus_path)
+
+            store = make_store(args.backend, f"bench_ingest_{corpus_size}", workdir)
+            start = time.perf_counter()
+            ingest_data.upsert_to_qdrant(
+                corpus_path,
+                collection_name=store.collection_name,
+                manifest_path=os.path.join(workdir, f"manifest-{corpus_size}.json"),
+                vector_store=store,
+                batch_size=args.batch_size,
+                loader_workers=args.loader_workers,
+                vector_size_text=args.dim,
+                vector_size_image=args.dim,
+                image_hashes_path=None,
+                article_duplicates_path=None,
+                article_renames_path=None
+            )
+            wall = time.perf_counter() - start
+            results.append({
+                "benchmark": "ingest",
+                "backend": args.backend,
+                "corpus_size": corpus_size,
+                "images": corpus_size * args.images_per_article,
+                "batch_size": args.batch_size,
+                "loader_workers": args.loader_workers,
+                "seconds": round(wall, 3),
+                "articles_per_second": round(corpus_size / wall, 2),
+                "images_per_second": round(corpus_size * args.images_per_article / wall, 2),
+                "points": store.count()
+            })
+
+    write_results(results, args.output)
+
+
+def bench_quantization(args):
+    from qdrant_client import QdrantClient
+
+    client = QdrantClient(args.url, port=args.port)
+    if args.source_collection:
+        corpus = load_collection_vectors(client, args.source_collection, args.vector_name, args.corpus_size)
+    else:
+        corpus = synthetic_vectors(args.corpus_size, args.dim)
+    queries = noisy_queries(corpus, args.queries)
+    truth = exact_top_k(corpus, queries, args.k)
+
+    results = []
+    for quantization in args.quantization:
+        quantization = None if quantization == "none" else quantization
+        label = quantization or "float32"
+        store = QdrantStore(client=client, collection_name=f"bench_quantization_{label}")
+        store.create_collection(
+            {"text": corpus.shape[1]},
+            quantization=quantization,
+            on_disk=args.on_disk,
+            hnsw_m=args.hnsw_m,
+            hnsw_ef_construct=args.hnsw_ef_construct
+        )
+        for start in range(0, len(corpus), 256):
+            store.upsert([
+                Point(start + i, {"text": vector}, {"type": "text"})
+                for i, vector in enumerate(corpus[start:start + 256])
+            ])
+        wait_until_indexed(client, store.collection_name)
+
+        oversamplings = args.oversampling if quantization else [None]
+        for hnsw_ef in args.hnsw_ef:
+            for oversampling in oversamplings:
+                latencies, recalls = [], []
+                for query, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    hits = store.search("text", query, "text", args.k, hnsw_ef=hnsw_ef,
+                                        oversampling=oversampling, rescore=True if quantization else None)
+                    latencies.append(time.perf_counter() - start)
+                    recalls.append(len({hit.id for hit in hits} & expected) / args.k)
+                results.append({
+                    "benchmark": "quantization",
+                    "quantization": label,
+                    "on_disk": args.on_disk,
+                    "hnsw_m": args.hnsw_m,
+                    "hnsw_ef_construct": args.hnsw_ef_construct,
+                    "hnsw_ef": hnsw_ef,
+                    "oversampling": oversampling,
+                    "corpus_size": len(corpus),
+                    "dim": int(corpus.shape[1]),
+                    f"recall@{args.k}": round(float(np.mean(recalls)), 4),
+                    "estimated_ram_bytes": estimated_ram_bytes(len(corpus), corpus.shape[1], quantization,
+                                                               args.on_disk, args.hnsw_m),
+                    **latency_summary(latencies)
+                })
+        if not args.keep:
+            client.delete_collection(store.collection_name)
+
+    write_results(results, args.output)
+
+
+def bench_transport(args):
+    corpus = synthetic_vectors(args.corpus_size, args.dim)
+    queries = noisy_queries(corpus, args.queries)
+    points = [
+        Point(i, {"text": vector}, {"type": "text", "article_id": f"article-{i}", "content": "x" * args.payload_chars})
+        for i, vector in enumerate(corpus)
+    ]
+
+    results = []
+    for transport in args.transports:
+        pool = get_qdrant_pool(args.url, args.port, args.grpc_port, prefer_grpc=transport == "grpc",
+                               pool_size=args.pool_size)
+        store = QdrantStore(collection_name=f"bench_transport_{transport}", pool=pool)
+        store.create_collection({"text": args.dim})
+
+        latencies = []
+        start = time.perf_counter()
+        for batch_start in range(0, len(points), args.batch_size):
+            batch_time = time.perf_counter()
+            store.upsert(points[batch_start:batch_start + args.batch_size])
+            latencies.append(time.perf_counter() - batch_time)
+        wall = time.perf_counter() - start
+        results.append({
+            "benchmark": "transport",
+            "transport": transport,
+            "operation": "upsert",
+            "points": len(points),
+            "dim": args.dim,
+            "batch_size": args.batch_size,
+            "points_per_second": round(len(points) / wall, 1),
+            **latency_summary(latencies)
+        })
+        wait_until_indexed(store.client, store.collection_name)
+
+        # One query = a text and an image-shaped request in a single batch call, as in LLM_search.retrieve.
+        def run_query(query):
+            query_start = time.perf_counter()
+            store.search_batch([SearchRequest("text", query, "text", args.k), SearchRequest("text", query, "text", args.k)])
+            return time.perf_counter() - query_start
+
+        for concurrency in args.concurrency:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(run_query, queries[:concurrency]))
+                start = time.perf_counter()
+                latencies = list(executor.map(run_query, queries))
+                wall = time.perf_counter() - start
+            results.append({
+                "benchmark": "transport",
+                "transport": transport,
+                "operation": "query",
+                "pool_size": args.pool_size,
+                "concurrency": concurrency,
+                "queries": len(queries),
+                "qps": round(len(queries) / wall, 1),
+                **latency_summary(latencies)
+            })
+        if not args.keep:
+            store.client.delete_collection(store.collection_name)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the search pipeline (JSON lines output).")
+    parser.add_argument('--output', default=None, help='Also append the JSON lines to this file')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    quantization = subparsers.add_parser(
+        "quantization", help="Memory, latency and recall@k of quantized collections versus float32 (needs Qdrant)"
+    )
+    quantization.add_argument('--url', default=QDRANT_URL)
+    quantization.add_argument('--port', type=int, default=QDRANT_PORT)
+    quantization.add_argument('--source-collection', default=None,
+                              help='Benchmark on vectors from this collection instead of synthetic ones')
+    quantization.add_argument('--vector-name', default="text", help='Named vector to read from --source-collection')
+    quantization.add_argument('--corpus-size', type=int, default=20000)
+    quantization.add_argument('--dim', type=int, default=768)
+    quantization.add_argument('--queries', type=int, default=200)
+    quantization.add_argument('--k', type=int, default=10)
+    quantization.add_argument('--quantization', nargs='+', default=["none", "int8", "binary"],
+                              choices=["none", "int8", "binary"])
+    quantization.add_argument('--on-disk', action='store_true')
+    quantization.add_argument('--hnsw-m', type=int, default=None)
+    quantization.add_argument('--hnsw-ef-construct', type=int, default=None)
+    quantization.add_argument('--hnsw-ef', type=int, nargs='+', default=[64, 128])
+    quantization.add_argument('--oversampling', type=float, nargs='+', default=[1.0, 2.0])
+    quantization.add_argument('--keep', action='store_true', help='Keep the benchmark collections')
+    quantization.set_defaults(func=bench_quantization)
+
+    transport = subparsers.add_parser(
+        "transport", help="Upsert and query throughput over REST versus gRPC (needs Qdrant)"
+    )
+    transport.add_argument('--url', default=QDRANT_URL)
+    transport.add_argument('--port', type=int, default=QDRANT_PORT)
+    transport.add_argument('--grpc-port', type=int, default=QDRANT_GRPC_PORT)
+    transport.add_argument('--transports', nargs='+', default=["rest", "grpc"], choices=["rest", "grpc"])
+    transport.add_argument('--corpus-size', type=int, default=10000)
+    transport.add_argument('--dim', type=int, default=768)
+    transport.add_argument('--batch-size', type=int, default=100, help='Points per upsert call')
+    transport.add_argument('--payload-chars', type=int, default=1000, help='Size of the content payload per point')
+    transport.add_argument('--queries', type=int, default=500)
+    transport.add_argument('--k', type=int, default=30)
+    transport.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    transport.add_argument('--pool-size', type=int, default=4)
+    transport.add_argument('--keep', action='store_true', help='Keep the benchmark collections')
+    transport.set_defaults(func=bench_transport)
+
+    pipeline = subparsers.add_parser(
+        "pipeline", help="Per-stage latency of query_gemini_multimodal with stub models (offline)"
+    )
+    pipeline.add_argument('--backend', choices=["qdrant-memory", "numpy"], default="qdrant-memory")
+    pipeline.add_argument('--corpus-sizes', type=int, nargs='+', default=[100, 1000])
+    pipeline.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    pipeline.add_argument('--queries', type=int, default=50)
+    pipeline.add_argument('--dim', type=int, default=768)
+    pipeline.add_argument('--top-k', type=int, default=10)
+    pipeline.add_argument('--gemini-latency', type=float, default=0.0, help='Simulated Gemini latency in seconds')
+    pipeline.add_argument('--seed', type=int, default=0)
+    pipeline.set_defaults(func=bench_pipeline)
+
+    ingest = subparsers.add_parser("ingest", help="Throughput of ingest_data.upsert_to_qdrant with stub models (offline)")
+    ingest.add_argument('--backend', choices=["qdrant-memory", "numpy"], default="qdrant-memory")
+    ingest.add_argument('--corpus-sizes', type=int, nargs='+', default=[50, 200])
+    ingest.add_argument('--images-per-article', type=int, default=2)
+    ingest.add_argument('--image-size', type=int, default=256)
+    ingest.add_argument('--batch-size', type=int, default=32)
+    ingest.add_argument('--loader-workers', type=int, default=4)
+    ingest.add_argument('--dim', type=int, default=768)
+    ingest.add_argument('--seed', type=int, default=0)
+    ingest.set_defaults(func=bench_ingest)
+
+    args = parser.parse_args()
+    args.func(args)
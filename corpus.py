@@ -0,0 +1,111 @@
+import os
+import ast
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from atomic_io import atomic_write
+
+# Written by scrapper.py, read by media_downloader.py.
+ARTICLES_PATH = "data/the_batch_articles.parquet"
+# Written by media_downloader.py (media_urls are local paths), read by ingest_data.py.
+ARTICLES_WITH_MEDIA_PATH = "data/articles_with_local_images.parquet"
+CORPUS_BATCH_SIZE = 256
+ROW_GROUP_SIZE = 1024
+
+ARTICLE_SCHEMA = pa.schema([
+    pa.field("url", pa.string(), nullable=False),
+    pa.field("title", pa.string()),
+    pa.field("content", pa.string()),
+    pa.field("media_urls", pa.list_(pa.string()))
+])
+
+
+def _csv_path(path):
+    return os.path.splitext(path)[0] + ".csv"
+
+
+def _resolve(path):
+    """
+    Returns the Parquet file if it exists, else the CSV written by older versions of the pipeline.
+    """
+    if os.path.exists(path) or not os.path.exists(_csv_path(path)):
+        return path
+    print(f"⚠️ {path} not found, reading legacy {_csv_path(path)}")
+    return _csv_path(path)
+
+
+def _read_legacy_csv(path, **kwargs):
+    import pandas as pd
+    return pd.read_csv(path, converters={'media_urls': ast.literal_eval}, **kwargs)
+
+
+def write_corpus(df, path):
+    """
+    Writes articles (a DataFrame or a list of dicts) as zstd-compressed Parquet with a native
+    list<string> media_urls column. Columns missing from df (e.g. an empty scrape) are written as nulls.
+    Written to a temporary file first, so readers never see a partial file.
+    """
+    if isinstance(df, list):
+        table = pa.Table.from_pylist(df, schema=ARTICLE_SCHEMA)
+    else:
+        columns = [field.name for field in ARTICLE_SCHEMA]
+        missing = [column for column in columns if column not in df.columns]
+        # Added as object columns of nulls; pandas' default float NaN columns do not convert to list<string>.
+        df = df.reindex(columns=columns).astype({column: object for column in missing})
+        table = pa.Table.from_pandas(df, schema=ARTICLE_SCHEMA, preserve_index=False)
+    atomic_write(path, lambda f: pq.write_table(table, f, compression="zstd", row_group_size=ROW_GROUP_SIZE),
+                 mode="wb")
+
+
+def read_corpus(path):
+    """Reads the whole corpus into a DataFrame (media_urls as lists)."""
+    path = _resolve(path)
+    if path.endswith(".csv"):
+        return _read_legacy_csv(path)
+    df = pq.read_table(path, schema=ARTICLE_SCHEMA).to_pandas()
+    df["media_urls"] = [list(urls) if urls is not None else [] for urls in df["media_urls"]]
+    return df
+
+
+def count_rows(path):
+    path = _resolve(path)
+    if path.endswith(".csv"):
+        return len(_read_legacy_csv(path, usecols=["url"]))
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def iter_corpus_batches(path, batch_size=CORPUS_BATCH_SIZE, columns=None):
+    """
+    Yields the corpus as lists of row dicts, batch_size rows at a time. Parquet is streamed
+    record batch by record batch, so memory stays flat whatever the corpus size.
+    """
+    path = _resolve(path)
+    if path.endswith(".csv"):
+        for chunk in _read_legacy_csv(path, chunksize=batch_size, usecols=columns):
+            yield chunk.to_dict("records")
+        return
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pylist()
+
+
+def convert_csv(csv_path, path=None):
+    """Converts a CSV written by an older version of the pipeline to Parquet."""
+    path = path or os.path.splitext(csv_path)[0] + ".parquet"
+    write_corpus(_read_legacy_csv(csv_path), path)
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert legacy CSV corpus files to Parquet.")
+    parser.add_argument('csv_paths', nargs='*',
+                        default=[_csv_path(ARTICLES_PATH), _csv_path(ARTICLES_WITH_MEDIA_PATH)])
+    args = parser.parse_args()
+
+    for csv_path in args.csv_paths:
+        if os.path.exists(csv_path):
+            print(f"✅ {csv_path} -> {convert_csv(csv_path)}")
+        else:
+            print(f"⚠️ {csv_path} not found")
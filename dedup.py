@@ -0,0 +1,429 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import numpy as np
+from PIL import Image
+
+from atomic_io import atomic_write
+
+IMAGE_HASHES_PATH = "data/media/image_hashes.json"
+DHASH_SIZE = 8
+# Two images whose 64-bit dHashes differ in at most this many bits are treated as the same picture
+# (re-encoded, resized or recompressed copies typically differ in 0-3 bits).
+DHASH_MAX_DISTANCE = 3
+# Flat or nearly uniform images (blank slides, solid backgrounds, simple gradients) hash to almost all
+# zeros or ones and would all look alike; hashes with fewer set or unset bits than this only match exactly.
+DHASH_MIN_BITS = 8
+
+ARTICLE_DUPLICATES_PATH = "data/article_duplicates.json"
+ARTICLE_RENAMES_PATH = "data/article_renames.json"
+# A paragraph found in at least this share of articles (and at least BOILERPLATE_MIN_ARTICLES of them)
+# is newsletter boilerplate: course promos, subscribe prompts, sign-offs.
+BOILERPLATE_MIN_SHARE = 0.1
+BOILERPLATE_MIN_ARTICLES = 5
+SHINGLE_WORDS = 5
+MINHASH_PERMUTATIONS = 128
+# 16 bands of 8 rows: pairs with Jaccard similarity around 0.7 and above become LSH candidates.
+LSH_BANDS = 16
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes; a < 2**31 keeps a * x within uint64.
+_MINHASH_PRIME = np.uint64(4294967311)
+TRACKING_PARAMS = {"ref", "fbclid", "gclid", "mc_cid", "mc_eid", "_hsenc", "_hsmi"}
+
+
+def file_sha256(path, chunk_size=1 << 16):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(image, hash_size=DHASH_SIZE):
+    """
+    Difference hash: the image is shrunk to (hash_size + 1) x hash_size grayscale pixels and
+    every bit says whether a pixel is brighter than its right neighbour.
+    """
+    image.draft("L", (hash_size * 4, hash_size * 4))
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def informative_dhash(value, hash_size=DHASH_SIZE, min_bits=DHASH_MIN_BITS):
+    """Whether a dHash carries enough structure (set and unset bits) for near-duplicate matching."""
+    ones = bin(value).count("1")
+    return min_bits <= ones <= hash_size * hash_size - min_bits
+
+
+def image_hashes(path):
+    """
+    Returns the exact (sha256) and perceptual (dHash, as hex) hashes of a media file;
+    dhash and pixels are None for files PIL cannot decode (e.g. videos).
+    """
+    hashes = {"sha256": file_sha256(path), "dhash": None, "pixels": None}
+    try:
+        with Image.open(path) as image:
+            hashes["pixels"] = image.width * image.height
+            hashes["dhash"] = format(dhash(image), "016x")
+    except Exception:
+        pass
+    return hashes
+
+
+def _groups(items, pairs):
+    """Connected components (union-find) of items linked by pairs, each group in items order."""
+    parent = {item: item for item in items}
+
+    def find(item):
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    for a, b in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+
+    groups = {}
+    for item in items:
+        groups.setdefault(find(item), []).append(item)
+    return list(groups.values())
+
+
+class ImageHashIndex:
+    """
+    Hashes of every downloaded media file, stored as JSON next to the media. Entries are keyed
+    by local path and recomputed when the file size or mtime changes. After dedupe(), every
+    duplicate records the path of its canonical copy in "duplicate_of"; the entry is kept after
+    the duplicate file is removed, so the same image is not downloaded or embedded again.
+    """
+
+    def __init__(self, path=IMAGE_HASHES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    def update(self, image_path):
+        """Hashes image_path unless the stored hashes are still current. Returns its entry."""
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(image_path)
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            return entry
+        entry = {**image_hashes(image_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        with self._lock:
+            self._entries[image_path] = entry
+        return entry
+
+    def canonical(self, image_path):
+        """The path the image is stored (and embedded) under; image_path itself if it is not a duplicate."""
+        # A canonical copy can itself become a duplicate later (a larger copy arrived), so follow the chain.
+        path, seen = image_path, set()
+        with self._lock:
+            while path not in seen:
+                seen.add(path)
+                target = (self._entries.get(path) or {}).get("duplicate_of")
+                if not target:
+                    break
+                path = target
+        return path if os.path.exists(path) else image_path
+
+    def duplicates(self):
+        with self._lock:
+            return {path: entry["duplicate_of"] for path, entry in self._entries.items() if entry.get("duplicate_of")}
+
+    def dedupe(self, max_distance=DHASH_MAX_DISTANCE):
+        """
+        Groups the existing files by identical sha256 or dHashes at most max_distance bits apart and
+        marks all but one file per group as duplicates. The canonical copy is the one with the most
+        pixels, then the largest file. Near-duplicates are matched against the canonical copy only,
+        so a chain of small differences cannot pull unrelated images into one group, and low-entropy
+        hashes (see DHASH_MIN_BITS) only match exact copies. Returns {duplicate path: canonical path}
+        for this run.
+        """
+        with self._lock:
+            live = [path for path in self._entries if os.path.exists(path)]
+            entries = {path: self._entries[path] for path in live}
+
+        def rank(path):
+            return entries[path].get("pixels") or 0, entries[path]["size"], path
+
+        # Exact copies always group; each group is led by its best copy, and the groups are visited best first.
+        by_sha = {}
+        for path in live:
+            by_sha.setdefault(entries[path]["sha256"], []).append(path)
+        exact = {}
+        for paths in by_sha.values():
+            paths.sort(key=rank, reverse=True)
+            exact[paths[0]] = paths
+        heads = sorted(exact, key=rank, reverse=True)
+
+        # Pigeonhole: hashes within max_distance bits agree exactly on at least one of max_distance + 1 bands,
+        # so only heads sharing a band value need a Hamming check.
+        near = {}
+        hashed = [(path, int(entries[path]["dhash"], 16)) for path in heads if entries[path].get("dhash")]
+        hashed = [(path, value) for path, value in hashed if informative_dhash(value)]
+        bands = np.array_split(np.arange(DHASH_SIZE * DHASH_SIZE), max_distance + 1)
+        for band in bands:
+            shift, mask = int(band[0]), (1 << len(band)) - 1
+            buckets = {}
+            for path, value in hashed:
+                buckets.setdefault((value >> shift) & mask, []).append((path, value))
+            for bucket in buckets.values():
+                for i, (path, value) in enumerate(bucket):
+                    for other, other_value in bucket[i + 1:]:
+                        if hamming(value, other_value) <= max_distance:
+                            near.setdefault(path, set()).add(other)
+                            near.setdefault(other, set()).add(path)
+
+        groups, grouped = [], set()
+        for head in heads:
+            if head in grouped:
+                continue
+            members = [head] + sorted((other for other in near.get(head, ()) if other not in grouped),
+                                      key=rank, reverse=True)
+            grouped.update(members)
+            groups.append([path for member in members for path in exact[member]])
+
+        duplicates = {}
+        with self._lock:
+            for paths in groups:
+                canonical = paths[0]
+                for path in paths:
+                    if path == canonical:
+                        self._entries[path].pop("duplicate_of", None)
+                    else:
+                        self._entries[path]["duplicate_of"] = canonical
+                        duplicates[path] = canonical
+        return duplicates
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._entries)
+        atomic_write(self.path, data)
+
+
+def remove_duplicate_files(duplicates, thumbnail_folder=None):
+    """Deletes duplicate media files (and their thumbnails); the hash index keeps pointing them to the canonical copy."""
+    from thumbnails import thumbnail_path
+
+    removed = 0
+    for path in duplicates:
+        for target in [path] + ([thumbnail_path(path, thumbnail_folder)] if thumbnail_folder else []):
+            if os.path.exists(target):
+                os.remove(target)
+                removed += target == path
+    return removed
+
+
+def normalize_url(url):
+    """
+    Canonical form of an article URL, so variants collected from different pages collapse to one:
+    lowercase scheme and host, no default port, fragment or tracking parameters, and a trailing
+    slash on extension-less paths.
+    """
+    parts = urlsplit(url.strip())
+    scheme, host = parts.scheme.lower(), parts.hostname or ""
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    if not path.endswith("/") and "." not in path.rsplit("/", 1)[-1]:
+        path += "/"
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS)
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def _paragraph_key(paragraph):
+    return " ".join(paragraph.lower().split())
+
+
+def boilerplate_paragraphs(contents, min_share=BOILERPLATE_MIN_SHARE, min_articles=BOILERPLATE_MIN_ARTICLES):
+    """
+    Paragraphs (lines of content, compared case- and whitespace-insensitively) that recur in at
+    least min_share of the articles and in at least min_articles of them.
+    """
+    document_frequency = {}
+    total = 0
+    for content in contents:
+        total += 1
+        keys = {_paragraph_key(line) for line in (content or "").split("\n")}
+        for key in keys - {""}:
+            document_frequency[key] = document_frequency.get(key, 0) + 1
+    threshold = max(min_articles, min_share * total)
+    return {key for key, frequency in document_frequency.items() if frequency >= threshold}
+
+
+def strip_boilerplate(content, boilerplate):
+    lines = (content or "").split("\n")
+    return "\n".join(line for line in lines if line.strip() and _paragraph_key(line) not in boilerplate)
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    """32-bit hashes of the overlapping size-word windows of text."""
+    words = re.findall(r"\w+", (text or "").lower())
+    windows = [" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))] if words else []
+    return np.unique(np.fromiter((zlib.crc32(window.encode("utf-8")) for window in windows),
+                                 dtype=np.uint64, count=len(windows)))
+
+
+def minhash_signatures(texts, permutations=MINHASH_PERMUTATIONS, seed=0):
+    """
+    One MinHash signature per text (uint64 array of shape (len(texts), permutations)); the share of
+    equal positions between two signatures estimates the Jaccard similarity of their shingle sets.
+    Texts without words get a signature of all-max values that matches nothing else.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=permutations, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=permutations, dtype=np.uint64)
+    signatures = np.full((len(texts), permutations), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for row, text in enumerate(texts):
+        values = shingles(text)
+        if len(values):
+            signatures[row] = ((a[:, None] * values[None, :] + b[:, None]) % _MINHASH_PRIME).min(axis=1)
+    return signatures
+
+
+def near_duplicate_pairs(signatures, bands=LSH_BANDS, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Index pairs whose estimated Jaccard similarity is at least threshold. LSH buckets the
+    signatures band by band, so only rows sharing a whole band are compared.
+    """
+    rows_per_band = signatures.shape[1] // bands
+    empty = (signatures == np.iinfo(np.uint64).max).all(axis=1)
+    candidates = set()
+    for band in range(bands):
+        buckets = {}
+        band_values = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        for row in np.flatnonzero(~empty):
+            buckets.setdefault(band_values[row].tobytes(), []).append(row)
+        for bucket in buckets.values():
+            candidates.update((bucket[i], other) for i in range(len(bucket)) for other in bucket[i + 1:])
+    return [(int(i), int(j)) for i, j in sorted(candidates)
+            if (signatures[i] == signatures[j]).mean() >= threshold]
+
+
+def near_duplicate_articles(articles, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Groups articles (dicts with url, title and content) whose text is near-identical and returns
+    {duplicate url: canonical url}. The canonical article is the longest one, then the first.
+    """
+    signatures = minhash_signatures([f"{article['title']}\n{article['content']}" for article in articles])
+    duplicates = {}
+    for group in _groups(range(len(articles)), near_duplicate_pairs(signatures, threshold=threshold)):
+        canonical = max(group, key=lambda i: (len(articles[i]['content'] or ""), -i))
+        for i in group:
+            if i != canonical:
+                duplicates[articles[i]['url']] = articles[canonical]['url']
+    return duplicates
+
+
+def clean_articles(df, boilerplate_share=BOILERPLATE_MIN_SHARE, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Prepares scraped articles for embedding:
+    normalises URLs and drops URL variants of the same article, strips paragraphs that recur
+    across the corpus, and drops near-duplicate articles (their media is kept on the canonical one).
+
+    Returns the cleaned DataFrame, {dropped url: canonical url} for URL variants that collided
+    with another article and for near-duplicates, and {original url: normalised url} for kept
+    articles whose URL was only rewritten.
+    """
+    duplicates, renamed = {}, {}
+    df = df.copy()
+    normalized = [normalize_url(url) for url in df["url"]]
+    seen = set()
+    for url, norm in zip(df["url"], normalized):
+        if norm not in seen:
+            seen.add(norm)
+            if url != norm:
+                renamed[url] = norm
+        elif url != norm and url not in renamed:
+            duplicates[url] = norm
+    url_variants = len(normalized) - len(seen)
+    df["url"] = normalized
+    df = df.drop_duplicates(subset="url", keep="first").reset_index(drop=True)
+
+    boilerplate = boilerplate_paragraphs(df["content"], min_share=boilerplate_share)
+    df["content"] = [strip_boilerplate(content, boilerplate) for content in df["content"]]
+
+    articles = df[["url", "title", "content"]].to_dict("records")
+    near_duplicates = near_duplicate_articles(articles, threshold=threshold)
+    if near_duplicates:
+        media = dict(zip(df["url"], df["media_urls"]))
+        for url, canonical in near_duplicates.items():
+            merged = list(media[canonical]) + [u for u in media[url] if u not in media[canonical]]
+            media[canonical] = merged
+        df = df[~df["url"].isin(near_duplicates)].reset_index(drop=True)
+        df["media_urls"] = [media[url] for url in df["url"]]
+    duplicates.update(near_duplicates)
+
+    print(f"🧹 {len(boilerplate)} boilerplate paragraphs stripped, {len(renamed)} URLs normalised, "
+          f"{len(near_duplicates)} near-duplicate articles and {url_variants} URL variants dropped")
+    return df, duplicates, renamed
+
+
+def load_article_duplicates(path=ARTICLE_DUPLICATES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_article_duplicates(duplicates, kept_urls, path=ARTICLE_DUPLICATES_PATH):
+    """
+    Merges duplicates into the record of dropped article URLs, which ingest uses to delete their
+    points; URLs that are articles in the current corpus again are forgotten.
+    """
+    kept_urls = set(kept_urls)
+    merged = {url: canonical for url, canonical in {**load_article_duplicates(path), **duplicates}.items()
+              if url not in kept_urls}
+    atomic_write(path, lambda f: json.dump(merged, f))
+    return merged
+
+
+def load_article_renames(path=ARTICLE_RENAMES_PATH):
+    return load_article_duplicates(path)
+
+
+def save_article_renames(renamed, kept_urls, path=ARTICLE_RENAMES_PATH):
+    """Same as save_article_duplicates, for the original URLs of articles that were kept under a normalised URL."""
+    return save_article_duplicates(renamed, kept_urls, path)
+
+
+if __name__ == "__main__":
+    from thumbnails import THUMBNAIL_FOLDER
+
+    parser = argparse.ArgumentParser(description="Find duplicate images among downloaded media.")
+    parser.add_argument('--media-folder', default="data/media")
+    parser.add_argument('--max-distance', type=int, default=DHASH_MAX_DISTANCE,
+                        help='Max dHash Hamming distance for two images to count as duplicates (0 = exact only)')
+    parser.add_argument('--delete-files', action='store_true',
+                        help='Delete duplicate files (and thumbnails) instead of only recording them')
+    args = parser.parse_args()
+
+    index = ImageHashIndex(os.path.join(args.media_folder, os.path.basename(IMAGE_HASHES_PATH)))
+    for entry in os.scandir(args.media_folder):
+        if entry.is_file() and not entry.name.endswith((".part", ".json", ".tmp")):
+            index.update(os.path.join(args.media_folder, entry.name).replace(os.sep, "/"))
+    duplicates = index.dedupe(args.max_distance)
+    removed = remove_duplicate_files(duplicates, THUMBNAIL_FOLDER) if args.delete_files else 0
+    index.save()
+    print(f"✅ {len(duplicates)} duplicate images found, {removed} files removed")
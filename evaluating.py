@@ -1,10 +1,24 @@
-from LLM_search import get_query_vector, get_query_vector_clip, search_text, search_images, model, load_image
+from LLM_search import retrieve, get_query_vectors, gemini_model, build_candidate_inputs, CONTEXT_TOKEN_BUDGET, GEMINI_MODEL_NAME
+from metrics import trace, latency_summary
+from rate_limiter import RateLimiter
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+import hashlib
+import threading
+import time
 import json
 import re
 import os
 
-def build_multimodal_gemini_prompt(query, text_hits, image_hits):
+JUDGMENTS_PATH = "data/eval_judgments.jsonl"
+# Part of every judgment key; bump it when the judge prompt changes so old judgments are not reused.
+JUDGE_PROMPT_VERSION = 1
+EVAL_WORKERS = 4
+# Client-side limit on Gemini requests per second (0 disables it).
+EVAL_RATE = 1.0
+JUDGE_RETRIES = 2
+
+def build_multimodal_gemini_prompt(query, text_hits, image_hits, token_budget=CONTEXT_TOKEN_BUDGET):
     prompt = f"""
 You are a helpful multimodal assistant.
 
@@ -42,34 +56,98 @@ Ranked Image Results:
 1. [Image #N] — Title: "<Title>" — Score: <relevance_score>
 2. ...
 """
-    inputs = [prompt.strip()]
-
-    for i, hit in enumerate(text_hits):
-        title = hit.payload.get("title", "No title")
-        text = hit.payload.get("content", "No content")
-        combined = f"Text #{i + 1}:\nTitle: {title}\nContent: {text}"
-        inputs.append(combined)
-
-    for i, hit in enumerate(image_hits):
-        caption = hit.payload.get("title", "No title")
-        image_path = hit.payload.get("image_path")
-        if image_path and os.path.exists(image_path):
-            img = load_image(image_path)
-            inputs.append(f"Image #{i + 1}:\nTitle: {caption}\nImage: {img}")
-        else:
-            inputs.append(f"Image #{i + 1}: [Missing image at {image_path}]")
-
-    return inputs
-
-def query_gemini_multimodal(query):
-    q_vec_text = get_query_vector(query)
-    q_vec_image = get_query_vector_clip(query)
-    text_hits = search_text(q_vec_text)
-    image_hits = search_images(q_vec_image)
+    return [prompt.strip()] + build_candidate_inputs(query, text_hits, image_hits, token_budget)
+
+
+class JudgmentStore:
+    """
+    Append-only JSON lines file of Gemini judgments, keyed by judgment_key. Every judgment is
+    written as soon as it arrives, so an interrupted run resumes where it stopped and a rerun
+    whose retrieval did not change reuses the stored judgments.
+    """
+
+    def __init__(self, path=JUDGMENTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = {}
+        self.reused = 0
+        self.judged = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A run killed mid-write can leave a truncated last line.
+                        continue
+                    self._records[record["key"]] = record
+
+    def get(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                self.reused += 1
+            return record
+
+    def put(self, key, record):
+        record = dict(record, key=key)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            self._records[key] = record
+            self.judged += 1
+
+    def stats(self):
+        return {"stored": len(self._records), "reused": self.reused, "judged": self.judged}
+
+
+def judgment_key(query, text_hits, image_hits, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Fingerprint of everything the judge sees: query, prompt version, model and the retrieved hits.
+    """
+    parts = [query, str(JUDGE_PROMPT_VERSION), GEMINI_MODEL_NAME, str(token_budget)]
+    for hit in list(text_hits) + list(image_hits):
+        payload = hit.payload or {}
+        parts += [str(hit.id), payload.get("title", ""), payload.get("content", ""), payload.get("image_path", "")]
+    return hashlib.sha1("\x1f".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+
+def query_gemini_multimodal(query, store=None, limiter=None, retries=JUDGE_RETRIES, vectors=None):
+    """
+    Retrieves candidates for the query and returns (judge_output, text_hits, image_hits, reused).
+    The judgment comes from the store when the same query retrieved the same hits before.
+    vectors are the query's precomputed (e5, CLIP) vectors, if any.
+    """
+    text_hits, image_hits = retrieve(query, vectors=vectors)
+    key = judgment_key(query, text_hits, image_hits)
+    record = store.get(key) if store is not None else None
+    if record is not None:
+        return record["output"], text_hits, image_hits, True
 
     gemini_input = build_multimodal_gemini_prompt(query, text_hits, image_hits)
-    response = model.generate_content(gemini_input, stream=False)
-    return response.text, text_hits, image_hits
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            response = gemini_model.get().generate_content(gemini_input, stream=False)
+            output = response.text
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"⚠️ Judge request for '{query}' failed ({e}), retrying")
+            time.sleep(2 ** attempt)
+
+    if store is not None:
+        # Document ids in prompt order let offline_eval.py turn judgments into qrels.
+        store.put(key, {
+            "query": query,
+            "output": output,
+            "text_docs": [hit.payload.get("url") for hit in text_hits],
+            "image_docs": [hit.payload.get("image_path") for hit in image_hits]
+        })
+    return output, text_hits, image_hits, False
 
 def parse_ranked_results(model_output):
     """
@@ -131,28 +209,61 @@ def evaluate_retrieval_metrics(texts, images, k=3):
     }
 
 
-def evaluate_multiple_queries(queries, k=3):
+def evaluate_query(query, k=3, store=None, limiter=None, vectors=None):
+    with trace("eval_query", query=query) as query_trace:
+        output, text_hits, image_hits, reused = query_gemini_multimodal(query, store, limiter, vectors=vectors)
+        texts, images = parse_ranked_results(output)
+        metrics = evaluate_retrieval_metrics(texts, images, k=k)
+    return {
+        "query": query,
+        "text_metrics": metrics["text_metrics"],
+        "image_metrics": metrics["image_metrics"],
+        "latency_s": round(query_trace.total_seconds, 3),
+        "reused_judgment": reused
+    }
+
+
+def _safe_evaluate_query(query, k, store, limiter, vectors=None):
+    try:
+        return evaluate_query(query, k, store, limiter, vectors)
+    except Exception as e:
+        print(f"❌ Query '{query}' failed: {e}")
+        return {"query": query, "error": str(e)}
+
+
+def evaluate_multiple_queries(queries, k=3, workers=EVAL_WORKERS, rate=EVAL_RATE, judgments_path=JUDGMENTS_PATH,
+                              batch_encode=True):
     """
     Evaluate retrieval performance across multiple queries.
 
-    Returns per-query results and average metrics across all queries.
+    Queries run on `workers` threads; Gemini requests are limited to `rate` per second.
+    Judgments are persisted in judgments_path (None keeps nothing). A failed query is reported
+    and left out of the averages instead of aborting the run. All queries are encoded up front,
+    as one batch per encoder, unless batch_encode is False.
+
+    Returns per-query results, average metrics, failures and timings.
     """
+    store = JudgmentStore(judgments_path) if judgments_path else None
+    limiter = RateLimiter(rate)
+    start = time.perf_counter()
+    vectors = [None] * len(queries)
+    if batch_encode and queries:
+        with trace("eval_encode", queries=len(queries)) as encode_trace:
+            vectors = list(zip(*get_query_vectors(queries)))
+        print(f"⏱️ Encoded {len(queries)} queries in {encode_trace.total_seconds:.2f}s")
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        results = list(executor.map(
+            lambda args: _safe_evaluate_query(args[0], k, store, limiter, args[1]), zip(queries, vectors)
+        ))
+    wall_time = time.perf_counter() - start
+
+    per_query_metrics = [result for result in results if "error" not in result]
+    failed = [result for result in results if "error" in result]
+
     all_text_precisions, all_text_recalls, all_text_f1s = [], [], []
     all_image_precisions, all_image_recalls, all_image_f1s = [], [], []
 
-    per_query_metrics = []
-
-    for query in queries:
-        output, text_hits, image_hits = query_gemini_multimodal(query)
-        texts, images = parse_ranked_results(output)
-
-        metrics = evaluate_retrieval_metrics(texts, images, k=k)
-        per_query_metrics.append({
-            "query": query,
-            "text_metrics": metrics["text_metrics"],
-            "image_metrics": metrics["image_metrics"]
-        })
-
+    for metrics in per_query_metrics:
         # Accumulate
         all_text_precisions.append(metrics["text_metrics"]["precision@k"])
         all_text_recalls.append(metrics["text_metrics"]["recall@k"])
@@ -162,48 +273,99 @@ def evaluate_multiple_queries(queries, k=3):
         all_image_recalls.append(metrics["image_metrics"]["recall@k"])
         all_image_f1s.append(metrics["image_metrics"]["f1@k"])
 
+    def average(values):
+        return round(sum(values) / len(values), 4) if values else 0.0
+
     # Compute macro-average
     avg_metrics = {
         "text": {
-            "avg_precision@k": round(sum(all_text_precisions) / len(all_text_precisions), 4),
-            "avg_recall@k": round(sum(all_text_recalls) / len(all_text_recalls), 4),
-            "avg_f1@k": round(sum(all_text_f1s) / len(all_text_f1s), 4),
+            "avg_precision@k": average(all_text_precisions),
+            "avg_recall@k": average(all_text_recalls),
+            "avg_f1@k": average(all_text_f1s),
         },
         "image": {
-            "avg_precision@k": round(sum(all_image_precisions) / len(all_image_precisions), 4),
-            "avg_recall@k": round(sum(all_image_recalls) / len(all_image_recalls), 4),
-            "avg_f1@k": round(sum(all_image_f1s) / len(all_image_f1s), 4),
+            "avg_precision@k": average(all_image_precisions),
+            "avg_recall@k": average(all_image_recalls),
+            "avg_f1@k": average(all_image_f1s),
         },
     }
 
     return {
         "per_query": per_query_metrics,
-        "avg_metrics": avg_metrics
+        "avg_metrics": avg_metrics,
+        "failed": failed,
+        "k": k,
+        "wall_time_s": round(wall_time, 3),
+        "latency": latency_summary([metrics["latency_s"] for metrics in per_query_metrics]),
+        "judgments": store.stats() if store is not None else None
     }
 
 
 def output_metrics(results):
+    k = results.get("k", 3)
     print("\n📊 Average Metrics across all queries:")
-    print(f"Text - Precision@3: {results['avg_metrics']['text']['avg_precision@k']}")
-    print(f"Text - Recall@3:    {results['avg_metrics']['text']['avg_recall@k']}")
-    print(f"Text - F1@3:        {results['avg_metrics']['text']['avg_f1@k']}")
+    print(f"Text - Precision@{k}: {results['avg_metrics']['text']['avg_precision@k']}")
+    print(f"Text - Recall@{k}:    {results['avg_metrics']['text']['avg_recall@k']}")
+    print(f"Text - F1@{k}:        {results['avg_metrics']['text']['avg_f1@k']}")
     print('\n')
-    print(f"Image - Precision@3: {results['avg_metrics']['image']['avg_precision@k']}")
-    print(f"Image - Recall@3:    {results['avg_metrics']['image']['avg_recall@k']}")
-    print(f"Image - F1@3:        {results['avg_metrics']['image']['avg_f1@k']}")
+    print(f"Image - Precision@{k}: {results['avg_metrics']['image']['avg_precision@k']}")
+    print(f"Image - Recall@{k}:    {results['avg_metrics']['image']['avg_recall@k']}")
+    print(f"Image - F1@{k}:        {results['avg_metrics']['image']['avg_f1@k']}")
+    print(f"\n⏱️ Wall time: {results['wall_time_s']}s for {len(results['per_query'])} queries")
+    if results["latency"]:
+        print(f"Per-query latency: {results['latency']}")
+    if results["judgments"]:
+        print(f"Judgments: {results['judgments']}")
+    if results["failed"]:
+        print(f"\n❌ {len(results['failed'])} queries failed (rerun to retry them):")
+        for failure in results["failed"]:
+            print(f"  {failure['query']}: {failure['error']}")
+
+
+def load_queries(path):
+    """
+    Reads queries from a JSON file (a list of strings) or a text file with one query per line.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate multiple queries.")
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         '--queries',
         type=str,
-        required=True,
         help='JSON-encoded list of queries (use double quotes around the list)'
     )
+    source.add_argument('--queries-file', type=str,
+                        help='JSON list of queries, or a text file with one query per line')
+    parser.add_argument('--k', type=int, default=3, help='Cut-off for Precision/Recall/F1@K')
+    parser.add_argument('--workers', type=int, default=EVAL_WORKERS, help='Queries evaluated concurrently')
+    parser.add_argument('--rate', type=float, default=EVAL_RATE,
+                        help='Max Gemini requests per second (0 = unlimited)')
+    parser.add_argument('--judgments', type=str, default=JUDGMENTS_PATH,
+                        help='JSON lines file with stored judgments (reused and resumed)')
+    parser.add_argument('--no-resume', action='store_true', help='Ignore and do not store judgments')
+    parser.add_argument('--no-batch-encode', action='store_true',
+                        help='Encode each query in its worker instead of the whole list up front')
+    parser.add_argument('--output', type=str, default=None, help='Write the full results as JSON to this file')
     args = parser.parse_args()
 
-    queries = json.loads(args.queries)
+    queries = json.loads(args.queries) if args.queries else load_queries(args.queries_file)
 
-    results = evaluate_multiple_queries(queries, k=3)
+    results = evaluate_multiple_queries(
+        queries,
+        k=args.k,
+        workers=args.workers,
+        rate=args.rate,
+        judgments_path=None if args.no_resume else args.judgments,
+        batch_encode=not args.no_batch_encode
+    )
     output_metrics(results)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
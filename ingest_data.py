@@ -1,92 +1,441 @@
+import os
+import argparse
+import json
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
-import open_clip
-from sentence_transformers import SentenceTransformer
 from PIL import Image
-import qdrant_client
-from qdrant_client.http import models as rest
-import io
 from tqdm import tqdm
 
-text_model = SentenceTransformer('intfloat/e5-base')
+from atomic_io import atomic_write
+from corpus import ARTICLES_WITH_MEDIA_PATH, count_rows, iter_corpus_batches
+from dedup import (ImageHashIndex, IMAGE_HASHES_PATH, ARTICLE_DUPLICATES_PATH, ARTICLE_RENAMES_PATH,
+                   load_article_duplicates, load_article_renames)
+from lazy import LazyResource
+from metrics import stage, count, submit, trace
+from vector_store import Point, open_store, COLLECTION_NAME
+
+
+def _create_text_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer('intfloat/e5-base')
+
+
+def _create_clip():
+    import open_clip
+    clip_model, _, preprocess = open_clip.create_model_and_transforms('ViT-L-14', pretrained='laion2b_s32b_b82k')
+    clip_model.eval()
+    return clip_model, preprocess
+
+
+# Loaded on first use, so the ingest path can also run with stub encoders (see benchmark.py).
+text_model = LazyResource("e5", _create_text_model)
+clip = LazyResource("clip", _create_clip)
+store = LazyResource("vector_store", open_store)
 
-clip_model, _, preprocess = open_clip.create_model_and_transforms('ViT-L-14', pretrained='laion2b_s32b_b82k')
-clip_model.eval()
+ARTICLE_BATCH_SIZE = 32
+IMAGE_BATCH_SIZE = 16
+IMAGE_LOADER_WORKERS = 4
+UPSERT_BATCH_SIZE = 100
+MANIFEST_PATH = "data/ingest_manifest.json"
+TEXT_VECTOR = "text"
+IMAGE_VECTOR = "image"
+# Passage windows in words; e5-base truncates at 512 tokens, so chunks stay well below that.
+CHUNK_WORDS = 200
+CHUNK_OVERLAP_WORDS = 50
 
-qdrant = qdrant_client.QdrantClient(url="http://localhost:6333")
+
+def chunk_text(content, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS):
+    words = content.split()
+    if not words:
+        return [""]
+    step = max(chunk_words - overlap_words, 1)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+def passage_text(title, chunk):
+    return f"passage: {title}. {chunk}"
 
 
 def get_text_embedding(title, content):
-    text = title + " " + content
-    emb = text_model.encode(text, convert_to_tensor=True)
+    emb = text_model.get().encode(passage_text(title, content), normalize_embeddings=True, convert_to_tensor=True)
     return emb.cpu().numpy()
 
 
+def get_text_embeddings(texts, batch_size=ARTICLE_BATCH_SIZE):
+    model = text_model.get()
+    with stage("ingest_encode_text"):
+        embs = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, convert_to_tensor=True)
+        return embs.cpu().numpy()
+
+
+def load_image_tensor(image_path):
+    _, preprocess = clip.get()
+    with stage("ingest_load_image"):
+        try:
+            image = Image.open(image_path).convert("RGB")
+        except Exception as e:
+            print(f"Failed to open {image_path}: {e}")
+            count("ingest_image_failures", help_text="Images that could not be opened during ingest.")
+            return None
+        return preprocess(image)
+
+
+def get_image_embeddings(image_tensors, batch_size=IMAGE_BATCH_SIZE):
+    clip_model, _ = clip.get()
+    embeddings = []
+    for start in range(0, len(image_tensors), batch_size):
+        image_input = torch.stack(image_tensors[start:start + batch_size])
+        with stage("ingest_encode_image"), torch.no_grad():
+            image_features = clip_model.encode_image(image_input)
+            image_features /= image_features.norm(dim=-1, keepdim=True)
+        embeddings.extend(image_features.cpu().numpy())
+    return embeddings
+
+
 def get_image_embedding(image_path):
-    try:
-        image = Image.open(image_path).convert("RGB")
-    except Exception as e:
-        print(f"Failed to open {image_path}: {e}")
+    image_tensor = load_image_tensor(image_path)
+    if image_tensor is None:
         return None
-    image_input = preprocess(image).unsqueeze(0)
-    with torch.no_grad():
-        image_features = clip_model.encode_image(image_input)
-        image_features /= image_features.norm(dim=-1, keepdim=True)
-    return image_features.cpu().numpy()[0]
+    return get_image_embeddings([image_tensor])[0]
+
+
+def text_point_id(url):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, url))
+
+
+def chunk_point_id(url, chunk_index):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{url}#chunk-{chunk_index}"))
+
+
+def image_point_id(image_path):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, "image:" + image_path))
+
+
+def text_fingerprint(title, content):
+    chunking = f"{CHUNK_WORDS}/{CHUNK_OVERLAP_WORDS}"
+    return hashlib.sha1(f"{chunking}\n{title}\n{content}".encode("utf-8")).hexdigest()
+
+
+def image_fingerprint(image_path, hash_index=None):
+    """Identifies the file content: its sha256 from the hash index, else its size and mtime."""
+    entry = hash_index.update(image_path) if hash_index is not None else None
+    if entry:
+        return entry["sha256"]
+    stat = os.stat(image_path)
+    return hashlib.sha1(f"{image_path}\n{stat.st_size}\n{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
 
 
-def upsert_to_qdrant(df, collection_name="articles_collection"):
-    vector_size_text = 768
-    vector_size_image = 768
+def owners_fingerprint(articles):
+    # The article list is part of the payload, so a new article reusing the image rewrites the payload.
+    owners = "\n".join(f"{article['url']}\t{article['title']}" for article in articles)
+    return hashlib.sha1(owners.encode("utf-8")).hexdigest()
 
-    if not qdrant.collection_exists(collection_name):
-        qdrant.recreate_collection(
-            collection_name=collection_name,
-            vectors_config=rest.VectorParams(size=vector_size_text, distance=rest.Distance.COSINE)
+
+def image_payload(articles, image_path):
+    return {
+        "title": articles[0]['title'],
+        "type": "image",
+        "image_path": image_path,
+        "articles": articles
+    }
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    atomic_write(path, lambda f: json.dump(manifest, f))
+
+
+def _iter_row_batches(corpus, batch_size, columns=("url", "title", "content", "media_urls")):
+    """Yields lists of row dicts from a corpus file path (streamed) or an in-memory DataFrame."""
+    if isinstance(corpus, str):
+        yield from iter_corpus_batches(corpus, batch_size, columns=list(columns))
+        return
+    for start in range(0, len(corpus), batch_size):
+        yield corpus.iloc[start:start + batch_size][list(columns)].to_dict("records")
+
+
+def collect_image_articles(corpus, hash_index=None, batch_size=ARTICLE_BATCH_SIZE):
+    """
+    Maps every distinct image (its canonical path in hash_index) to the articles that use it,
+    in corpus order. Only url, title and media_urls are read, so this pass is cheap.
+    """
+    image_articles = {}
+    for rows in _iter_row_batches(corpus, batch_size, columns=("url", "title", "media_urls")):
+        for row in rows:
+            article = {"url": row['url'], "title": row['title'], "article_id": text_point_id(row['url'])}
+            for media_path in row['media_urls'] if isinstance(row['media_urls'], list) else []:
+                canonical = hash_index.canonical(media_path) if hash_index is not None else media_path
+                owners = image_articles.setdefault(canonical, [])
+                if article["article_id"] not in (owner["article_id"] for owner in owners):
+                    owners.append(article)
+    return image_articles
+
+
+def _submit_image_loads(executor, rows, embedded, image_articles, submitted, payload_updates, hash_index=None):
+    # Decoding and preprocessing run on the pool, one batch ahead of the encoders.
+    # Each distinct image is loaded once, however many articles reference it.
+    # Images whose file is unchanged but whose articles changed only need their payload rewritten.
+    jobs = []
+    if rows is None:
+        return jobs
+    for row in rows:
+        if isinstance(row['media_urls'], list):
+            for media_path in row['media_urls']:
+                if hash_index is not None:
+                    media_path = hash_index.canonical(media_path)
+                if media_path in submitted or not os.path.exists(media_path):
+                    continue
+                submitted.add(media_path)
+                articles = image_articles[media_path]
+                point_id = image_point_id(media_path)
+                # Older manifests stored one string per image; those images are embedded again once.
+                previous = embedded.get(point_id)
+                fingerprint = {"content": image_fingerprint(media_path, hash_index),
+                               "owners": owners_fingerprint(articles)}
+                if previous == fingerprint:
+                    continue
+                if isinstance(previous, dict) and previous.get("content") == fingerprint["content"]:
+                    payload_updates.append((point_id, fingerprint, image_payload(articles, media_path)))
+                    continue
+                jobs.append((point_id, fingerprint, articles, media_path,
+                             submit(executor, load_image_tensor, media_path)))
+    return jobs
+
+
+def _delete_legacy_points(vector_store):
+    """
+    Removes points written before point IDs were content-addressed. They used sequential
+    integer ids, so they would otherwise stay next to their UUID replacements.
+    """
+    # Qdrant returns them as ints; the NumPy store keeps every id as a string.
+    legacy = [point_id for point_id in vector_store.point_ids() if str(point_id).isdigit()]
+    if legacy:
+        vector_store.delete_points(legacy)
+    return len(legacy)
+
+
+def _delete_duplicate_images(vector_store, embedded, hash_index):
+    """Removes points embedded for images that have since been found to duplicate another image."""
+    stale = [image_point_id(path) for path in hash_index.duplicates()]
+    stale = [point_id for point_id in stale if point_id in embedded]
+    if stale:
+        vector_store.delete_points(stale)
+        for point_id in stale:
+            embedded.pop(point_id)
+    return len(stale)
+
+
+def _delete_duplicate_articles(vector_store, embedded, article_duplicates):
+    """
+    Removes the chunks stored under article URLs that media_downloader.py dropped (URL variants,
+    near-duplicates) or rewrote to their normalised form.
+    """
+    stale = [text_point_id(url) for url in article_duplicates]
+    stale = [article_id for article_id in stale if article_id in embedded]
+    if stale:
+        vector_store.delete_articles(stale)
+        for article_id in stale:
+            embedded.pop(article_id)
+    return len(stale)
+
+
+def upsert_to_qdrant(corpus, collection_name=COLLECTION_NAME, batch_size=ARTICLE_BATCH_SIZE,
+                     loader_workers=IMAGE_LOADER_WORKERS, manifest_path=MANIFEST_PATH, vector_store=None,
+                     quantization=None, on_disk=False, hnsw_m=None, hnsw_ef_construct=None,
+                     vector_size_text=768, vector_size_image=768, image_hashes_path=IMAGE_HASHES_PATH,
+                     article_duplicates_path=ARTICLE_DUPLICATES_PATH, article_renames_path=ARTICLE_RENAMES_PATH):
+    """
+    corpus is the path of a Parquet corpus (read in streaming record batches) or a DataFrame.
+
+    Images are embedded once per distinct file: duplicates recorded in the hash index at
+    image_hashes_path (written by media_downloader.py) resolve to their canonical copy, and
+    each image point lists every article it appears in. Articles recorded at article_duplicates_path
+    (dropped by media_downloader.py) are deleted from the store, and so are the points of the
+    original URLs recorded at article_renames_path (re-embedded under their normalised URL).
+    """
+    vector_store = vector_store or (store.get() if collection_name == COLLECTION_NAME
+                                    else open_store(collection_name=collection_name))
+    manifest = load_manifest(manifest_path)
+    if not vector_store.collection_exists():
+        vector_store.create_collection(
+            {TEXT_VECTOR: vector_size_text, IMAGE_VECTOR: vector_size_image},
+            quantization=quantization,
+            on_disk=on_disk,
+            hnsw_m=hnsw_m,
+            hnsw_ef_construct=hnsw_ef_construct
+        )
+        manifest.pop(vector_store.name, None)
+    elif quantization or on_disk or hnsw_m is not None or hnsw_ef_construct is not None:
+        # Creation options would otherwise be silently ignored for an existing collection.
+        print(f"Updating options of existing collection {vector_store.name}")
+        vector_store.update_collection(
+            quantization=quantization,
+            on_disk=on_disk or None,
+            hnsw_m=hnsw_m,
+            hnsw_ef_construct=hnsw_ef_construct
         )
+    vector_store.validate_collection()
+    if vector_store.name not in manifest:
+        # First run against a collection this manifest has never seen, e.g. one filled by an older version.
+        removed = _delete_legacy_points(vector_store)
+        if removed:
+            print(f"Removed {removed} points with legacy integer ids")
+        manifest[vector_store.name] = {}
+        save_manifest(manifest, manifest_path)
+    embedded = manifest[vector_store.name]
+    hash_index = ImageHashIndex(image_hashes_path) if image_hashes_path and os.path.exists(image_hashes_path) else None
+    if hash_index is not None:
+        removed = _delete_duplicate_images(vector_store, embedded, hash_index)
+        if removed:
+            save_manifest(manifest, manifest_path)
+            print(f"Removed {removed} duplicate image points")
+    if article_duplicates_path:
+        removed = _delete_duplicate_articles(vector_store, embedded, load_article_duplicates(article_duplicates_path))
+        if removed:
+            save_manifest(manifest, manifest_path)
+            print(f"Removed {removed} duplicate articles")
+    if article_renames_path:
+        removed = _delete_duplicate_articles(vector_store, embedded, load_article_renames(article_renames_path))
+        if removed:
+            save_manifest(manifest, manifest_path)
+            print(f"Removed {removed} articles stored under their pre-normalisation URL")
+    image_articles = collect_image_articles(corpus, hash_index)
+    submitted = set()
 
     points = []
-    point_id = 0
+    fingerprints = {}
+    changed_articles = []
+    payload_updates = []
 
-    for idx, row in tqdm(df.iterrows(), total=len(df), desc="Uploading to Qdrant"):
-        title = row['title']
-        content = row['content']
+    def flush():
+        # Changed articles may now have fewer chunks, so their old chunks are dropped first.
+        with stage("ingest_upsert"):
+            vector_store.delete_articles(changed_articles)
+            vector_store.upsert(points)
+            for point_id, _, payload in payload_updates:
+                vector_store.set_payload(point_id, payload)
+            vector_store.flush()
+        count("ingest_points", len(points), "Points written to the vector store.")
+        count("ingest_payload_updates", len(payload_updates), "Image points whose payload alone was rewritten.")
+        # Only record points once the store has them, so a crashed run resumes from here.
+        embedded.update(fingerprints)
+        embedded.update((point_id, fingerprint) for point_id, fingerprint, _ in payload_updates)
+        save_manifest(manifest, manifest_path)
+        points.clear()
+        fingerprints.clear()
+        changed_articles.clear()
+        payload_updates.clear()
 
-        text_emb = get_text_embedding(title, content)
-        points.append(rest.PointStruct(
-            id=point_id,
-            vector=text_emb.tolist(),
-            payload={"url": row['url'], "title": title, "content": content, "type": "text"}
-        ))
-        point_id += 1
+    skipped = 0
+    with trace("ingest", collection=vector_store.name), \
+            ThreadPoolExecutor(max_workers=loader_workers) as executor, \
+            tqdm(total=count_rows(corpus) if isinstance(corpus, str) else len(corpus),
+                 desc="Uploading to vector store") as progress:
+        row_batches = _iter_row_batches(corpus, batch_size)
+        rows = next(row_batches, None)
+        image_jobs = _submit_image_loads(executor, rows, embedded, image_articles, submitted, payload_updates,
+                                         hash_index)
 
-        if isinstance(row['media_urls'], list) and len(row['media_urls']) > 0:
-            for media_path in row['media_urls']:
+        while rows is not None:
+            next_rows = next(row_batches, None)
+            next_image_jobs = _submit_image_loads(executor, next_rows, embedded, image_articles, submitted,
+                                                  payload_updates, hash_index)
 
-                if os.path.exists(media_path):
-                    img_emb = get_image_embedding(media_path)
+            chunks = []
+            for row in rows:
+                article_id = text_point_id(row['url'])
+                fingerprint = text_fingerprint(row['title'], row['content'])
+                if embedded.get(article_id) == fingerprint:
+                    skipped += 1
+                    continue
+                article_chunks = chunk_text(row['content'])
+                for chunk_index, chunk in enumerate(article_chunks):
+                    chunks.append((row, article_id, chunk_index, len(article_chunks), chunk))
+                changed_articles.append(article_id)
+                fingerprints[article_id] = fingerprint
 
-                    if img_emb is not None:
-                        points.append(rest.PointStruct(
-                            id=point_id,
-                            vector=img_emb.tolist(),
-                            payload={
-                                "title": title,
-                                "type": "image",
-                                "image_path": media_path
-                            }
-                        ))
-                        point_id += 1
+            if chunks:
+                texts = [passage_text(row['title'], chunk) for row, _, _, _, chunk in chunks]
+                text_embs = get_text_embeddings(texts, batch_size=batch_size)
+                for (row, article_id, chunk_index, chunk_count, chunk), text_emb in zip(chunks, text_embs):
+                    points.append(Point(
+                        id=chunk_point_id(row['url'], chunk_index),
+                        vectors={TEXT_VECTOR: text_emb},
+                        payload={
+                            "url": row['url'],
+                            "title": row['title'],
+                            "content": chunk,
+                            "type": "text",
+                            "article_id": article_id,
+                            "chunk_index": chunk_index,
+                            "chunk_count": chunk_count
+                        }
+                    ))
 
-        if len(points) >= 100:
-            qdrant.upsert(collection_name=collection_name, points=points)
-            points = []
+            loaded = [(point_id, fingerprint, articles, media_path, job.result())
+                      for point_id, fingerprint, articles, media_path, job in image_jobs]
+            loaded = [item for item in loaded if item[4] is not None]
+            img_embs = get_image_embeddings([item[4] for item in loaded])
+            for (point_id, fingerprint, articles, media_path, _), img_emb in zip(loaded, img_embs):
+                points.append(Point(
+                    id=point_id,
+                    vectors={IMAGE_VECTOR: img_emb},
+                    payload=image_payload(articles, media_path)
+                ))
+                fingerprints[point_id] = fingerprint
 
-    if points:
-        qdrant.upsert(collection_name=collection_name, points=points)
+            if len(points) + len(payload_updates) >= UPSERT_BATCH_SIZE:
+                flush()
+
+            progress.update(len(rows))
+            rows, image_jobs = next_rows, next_image_jobs
+
+        if points or payload_updates:
+            flush()
+        count("ingest_articles_skipped", skipped, "Unchanged articles skipped during ingest.")
+    if skipped:
+        print(f"Skipped {skipped} unchanged articles")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed articles and images into the vector store.")
+    parser.add_argument('--quantization', choices=['int8', 'binary'], default=None,
+                        help='Quantize vectors (originals are kept for rescoring); applied to an existing collection too')
+    parser.add_argument('--on-disk', action='store_true', help='Keep original vectors on disk instead of RAM')
+    parser.add_argument('--hnsw-m', type=int, default=None, help='HNSW graph degree (m)')
+    parser.add_argument('--hnsw-ef-construct', type=int, default=None, help='HNSW ef_construct')
+    parser.add_argument('--corpus', default=ARTICLES_WITH_MEDIA_PATH, help='Parquet corpus written by media_downloader.py')
+    parser.add_argument('--image-hashes', default=IMAGE_HASHES_PATH,
+                        help='Image hash index written by media_downloader.py (duplicates are embedded once)')
+    parser.add_argument('--article-duplicates', default=ARTICLE_DUPLICATES_PATH,
+                        help='Dropped article URLs written by media_downloader.py (their points are deleted)')
+    parser.add_argument('--article-renames', default=ARTICLE_RENAMES_PATH,
+                        help='Original URLs of normalised articles written by media_downloader.py (their old points are deleted)')
+    args = parser.parse_args()
+
     os.makedirs("data", exist_ok=True)
-    df = pd.read_csv('data/articles_with_local_images.csv', converters={'media_urls': ast.literal_eval})
-    upsert_to_qdrant(df)
-    print('Data ingested')
\ No newline at end of file
+    upsert_to_qdrant(
+        args.corpus,
+        quantization=args.quantization,
+        on_disk=args.on_disk,
+        hnsw_m=args.hnsw_m,
+        hnsw_ef_construct=args.hnsw_ef_construct,
+        image_hashes_path=args.image_hashes,
+        article_duplicates_path=args.article_duplicates,
+        article_renames_path=args.article_renames
+    )
+    print('Data ingested')
@@ -0,0 +1,39 @@
+import threading
+import time
+
+# Seconds spent initialising each component, filled in as they are first used.
+STARTUP_TIMINGS = {}
+
+
+class LazyResource:
+    """
+    Thread-safe lazily initialised singleton. The factory runs once, on first get(),
+    and its duration is recorded in STARTUP_TIMINGS under the resource name.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded = False
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    start = time.perf_counter()
+                    self._value = self._factory()
+                    STARTUP_TIMINGS[self.name] = time.perf_counter() - start
+                    self._loaded = True
+        return self._value
+
+    def set(self, value):
+        """Replaces the resource, e.g. with a stub, without running the factory."""
+        with self._lock:
+            self._value = value
+            self._loaded = True
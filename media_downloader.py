@@ -1,17 +1,28 @@
 import os
+import json
+import argparse
 import requests
 import hashlib
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from ast import literal_eval
 from urllib.parse import urlparse, parse_qs, unquote
 from tqdm import tqdm
 from pathlib import Path
-import ast
+
+from atomic_io import atomic_write
+from corpus import ARTICLES_PATH, ARTICLES_WITH_MEDIA_PATH, read_corpus, write_corpus
+from thumbnails import make_thumbnail, is_image_file, THUMBNAIL_FOLDER
+from dedup import (ImageHashIndex, IMAGE_HASHES_PATH, DHASH_MAX_DISTANCE, remove_duplicate_files, clean_articles,
+                   save_article_duplicates, save_article_renames, BOILERPLATE_MIN_SHARE, NEAR_DUPLICATE_THRESHOLD)
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0"
 }
 
+DOWNLOAD_WORKERS = 8
+CHUNK_SIZE = 64 * 1024
 
 
 def get_extension_from_url(url):
@@ -29,69 +40,238 @@ def get_extension_from_url(url):
     ext = os.path.splitext(path)[1].lower()
     return ext[1:] if ext.startswith('.') else ext
 
-def download_media(media_urls, media_folder="data/media"):
-    os.makedirs(media_folder, exist_ok=True)
-    local_paths = []
+def make_session(pool_size=DOWNLOAD_WORKERS):
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def media_filepath(url, media_folder="data/media"):
+    ext = get_extension_from_url(url)
+    if not ext:
+        return None
+    filename = hashlib.md5(url.encode()).hexdigest() + "." + ext
+    return Path(media_folder) / filename
+
+
+def _validators_path(filepath):
+    return filepath.parent / ".meta" / (filepath.name + ".json")
+
+
+def _load_validators(filepath):
+    meta_path = _validators_path(filepath)
+    if not meta_path.exists():
+        return {}
+    try:
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_validators(filepath, response):
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified")
+    }
+    if not any(validators.values()):
+        return
+    atomic_write(_validators_path(filepath), json.dumps(validators))
+
+
+def download_file(session, url, media_folder="data/media", refresh=False):
+    """
+    Downloads a single URL into media_folder and returns its local posix path, or None on failure.
+
+    Files that already exist are kept as-is unless refresh is set, in which case the request
+    is made conditional on the stored ETag / Last-Modified and a 304 keeps the local copy.
+    """
+    filepath = media_filepath(url, media_folder)
+    if filepath is None:
+        print(f"⚠️ No extension found in URL: {url}")
+        return None
+
+    exists = filepath.exists()
+    if exists and not refresh:
+        return filepath.as_posix()
+
+    headers = {}
+    if exists:
+        validators = _load_validators(filepath)
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
 
-    for url in media_urls:
-        if not isinstance(url, str):
-            continue
+    try:
+        with session.get(url, headers=headers, timeout=10, stream=True) as response:
+            if response.status_code == 304 and exists:
+                return filepath.as_posix()
+            if response.status_code != 200:
+                return None
 
-        try:
-            response = requests.get(url, headers=HEADERS, timeout=10)
-            if response.status_code == 200:
-                ext = get_extension_from_url(url)
-                if not ext:
-                    print(f"⚠️ No extension found in URL: {url}")
-                    continue
+            def write_body(f):
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
 
-                filename = hashlib.md5(url.encode()).hexdigest() + "." + ext
-                filepath = Path(media_folder) / filename
-                filepath_str = filepath.as_posix()
+            # An interrupted download leaves only the .part file, never a truncated media file.
+            atomic_write(filepath, write_body, mode="wb", suffix=".part")
+            _save_validators(filepath, response)
 
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
+    except Exception as e:
+        print(f"❌ Failed to download {url}: {e}")
+        return None
 
-                local_paths.append(filepath_str)
+    return filepath.as_posix()
 
-        except Exception as e:
-            print(f"❌ Failed to download {url}: {e}")
-            continue
 
-    return local_paths
+def _download_with_thumbnail(session, url, media_folder, refresh, thumbnail_folder, hash_index=None):
+    if hash_index is not None and not refresh:
+        # Duplicates removed by an earlier run resolve to their canonical copy instead of being fetched again.
+        filepath = media_filepath(url, media_folder)
+        canonical = hash_index.canonical(filepath.as_posix()) if filepath else None
+        if canonical and canonical != filepath.as_posix():
+            return canonical
 
+    filepath = download_file(session, url, media_folder, refresh)
+    if filepath and thumbnail_folder:
+        make_thumbnail(filepath, thumbnail_folder)
+    if filepath and hash_index is not None:
+        hash_index.update(filepath)
+    return filepath
 
 
-def process_dataframe(df):
-    updated_media = []
+def download_all(urls, media_folder="data/media", workers=DOWNLOAD_WORKERS, session=None, refresh=False,
+                 thumbnail_folder=THUMBNAIL_FOLDER, hash_index=None):
+    """
+    Downloads every distinct URL with bounded concurrency over one pooled session
+    and writes a thumbnail for each downloaded image into thumbnail_folder.
+    With a hash_index, every file is hashed as it lands (see dedup.py).
 
-    for raw_urls in tqdm(df["media_urls"], desc="📥 Processing media"):
-        try:
-            urls = literal_eval(raw_urls) if isinstance(raw_urls, str) else raw_urls
-        except Exception as e:
-            print(f"⚠️ Invalid format: {raw_urls} — {e}")
+    Returns a dict mapping each URL to its local path (None for failed downloads).
+    """
+    os.makedirs(media_folder, exist_ok=True)
+    unique_urls = list(dict.fromkeys(u for u in urls if isinstance(u, str)))
+    session = session or make_session(pool_size=workers)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_download_with_thumbnail, session, url, media_folder, refresh, thumbnail_folder, hash_index): url
+            for url in unique_urls
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="📥 Downloading media"):
+            results[futures[future]] = future.result()
+    return results
+
+
+def generate_thumbnails(media_folder="data/media", thumbnail_folder=THUMBNAIL_FOLDER, workers=DOWNLOAD_WORKERS):
+    """
+    Builds missing or outdated thumbnails for the images already in media_folder, e.g. after restoring a snapshot.
+    """
+    paths = [entry.path for entry in os.scandir(media_folder) if entry.is_file() and is_image_file(entry.name)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(tqdm(executor.map(lambda path: make_thumbnail(path, thumbnail_folder), paths),
+                  total=len(paths), desc="🖼️ Generating thumbnails"))
+
+
+def download_media(media_urls, media_folder="data/media", session=None, refresh=False):
+    downloaded = download_all(media_urls, media_folder, session=session, refresh=refresh)
+    return [downloaded[url] for url in media_urls if isinstance(url, str) and downloaded.get(url)]
+
+
+def _flatten_media_urls(raw_urls):
+    try:
+        # Strings only come from legacy CSV files; Parquet gives lists (or None for a null cell).
+        urls = literal_eval(raw_urls) if isinstance(raw_urls, str) else raw_urls
+        if urls is None:
             urls = []
+    except Exception as e:
+        print(f"⚠️ Invalid format: {raw_urls} — {e}")
+        urls = []
 
-        flat_urls = []
-        for u in urls:
-            if isinstance(u, list):
-                flat_urls.extend(u)
-            else:
-                flat_urls.append(u)
+    flat_urls = []
+    for u in urls:
+        if isinstance(u, list):
+            flat_urls.extend(u)
+        else:
+            flat_urls.append(u)
+    return flat_urls
 
-        local_paths = download_media(flat_urls)
-        updated_media.append(local_paths)
 
-    df["media_urls"] = updated_media
+def process_dataframe(df, media_folder="data/media", workers=DOWNLOAD_WORKERS, session=None, refresh=False,
+                      dedupe=True, max_distance=DHASH_MAX_DISTANCE, delete_duplicates=False):
+    """
+    Downloads the media of every article and replaces media_urls with local paths.
+
+    With dedupe, identical or near-identical images (same sha256 or close dHash) stored under
+    different URLs collapse to one canonical file, so every article references that file and
+    ingest embeds it once. Duplicate files stay on disk unless delete_duplicates is set.
+    """
+    rows = [_flatten_media_urls(raw_urls) for raw_urls in df["media_urls"]]
+    hash_index = ImageHashIndex(os.path.join(media_folder, os.path.basename(IMAGE_HASHES_PATH))) if dedupe else None
+    downloaded = download_all(
+        [url for urls in rows for url in urls],
+        media_folder,
+        workers=workers,
+        session=session,
+        refresh=refresh,
+        hash_index=hash_index
+    )
+
+    if hash_index is not None:
+        duplicates = hash_index.dedupe(max_distance)
+        removed = remove_duplicate_files(duplicates, THUMBNAIL_FOLDER) if delete_duplicates else 0
+        hash_index.save()
+        print(f"🧬 {len(duplicates)} duplicate images, {removed} files removed")
+        downloaded = {url: hash_index.canonical(path) if path else None for url, path in downloaded.items()}
+
+    df["media_urls"] = [
+        list(dict.fromkeys(downloaded[url] for url in urls if isinstance(url, str) and downloaded.get(url)))
+        for urls in rows
+    ]
     return df
 
 if __name__ == "__main__":
-    df=pd.read_csv('data/the_batch_articles.csv', converters={'media_urls': ast.literal_eval})
-    df=process_dataframe(df)
-    df['content'] = df['content'].str.replace(
-        "✨ New course! Enroll in Reinforcement Fine-Tuning LLMs with GRPO\n",
-        "",
-        regex=False
-    )
-    df.to_csv("data/articles_with_local_images.csv")
+    parser = argparse.ArgumentParser(description="Download article media into data/media.")
+    parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS, help='Number of concurrent downloads')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Re-check existing files with conditional requests (ETag / Last-Modified)')
+    parser.add_argument('--thumbnails-only', action='store_true',
+                        help='Only build thumbnails for files already in data/media')
+    parser.add_argument('--input', default=ARTICLES_PATH, help='Parquet corpus written by scrapper.py')
+    parser.add_argument('--output', default=ARTICLES_WITH_MEDIA_PATH, help='Parquet corpus with local media paths')
+    parser.add_argument('--no-dedupe', action='store_true', help='Keep duplicate images under every URL')
+    parser.add_argument('--max-distance', type=int, default=DHASH_MAX_DISTANCE,
+                        help='Max dHash Hamming distance for two images to count as duplicates (0 = exact only)')
+    parser.add_argument('--delete-duplicates', action='store_true',
+                        help='Delete duplicate files (and thumbnails) once articles point at the canonical copy')
+    parser.add_argument('--no-clean', action='store_true',
+                        help='Keep boilerplate paragraphs, URL variants and near-duplicate articles')
+    parser.add_argument('--boilerplate-share', type=float, default=BOILERPLATE_MIN_SHARE,
+                        help='Strip paragraphs found in at least this share of articles')
+    parser.add_argument('--near-duplicate-threshold', type=float, default=NEAR_DUPLICATE_THRESHOLD,
+                        help='Drop articles whose estimated Jaccard similarity (MinHash) to a longer one is at least this')
+    args = parser.parse_args()
+
+    if args.thumbnails_only:
+        generate_thumbnails(workers=args.workers)
+        raise SystemExit(0)
+
+    df=read_corpus(args.input)
+    if not args.no_clean:
+        # Before downloading, so media of dropped articles is only fetched through their canonical article.
+        df, article_duplicates, article_renames = clean_articles(df, args.boilerplate_share,
+                                                                 args.near_duplicate_threshold)
+        save_article_duplicates(article_duplicates, df["url"])
+        save_article_renames(article_renames, df["url"])
+    df=process_dataframe(df, workers=args.workers, refresh=args.refresh, dedupe=not args.no_dedupe,
+                     max_distance=args.max_distance, delete_duplicates=args.delete_duplicates)
+    write_corpus(df, args.output)
     print("Media downloading complete")
\ No newline at end of file
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Port of the local Prometheus endpoint started by app.py; 0 disables it.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Every finished trace is appended to this JSON lines file when it is set.
+METRICS_TRACE_PATH = os.getenv("METRICS_TRACE_PATH")
+METRIC_PREFIX = "rag_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+
+
+def _percentile(ordered, q):
+    # Linear interpolation between closest ranks, like numpy.percentile's default.
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(latencies):
+    """Percentiles, max and mean of latencies given in seconds, reported in milliseconds ({} for none)."""
+    if not latencies:
+        return {}
+    ordered = sorted(float(seconds) * 1000 for seconds in latencies)
+    return {
+        "p50_ms": round(_percentile(ordered, 50), 3),
+        "p95_ms": round(_percentile(ordered, 95), 3),
+        "p99_ms": round(_percentile(ordered, 99), 3),
+        "max_ms": round(ordered[-1], 3),
+        "mean_ms": round(sum(ordered) / len(ordered), 3)
+    }
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label key -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, state):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(state[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix=METRIC_PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(self.prefix + name, *args)
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get_or_create(Counter, name + "_total", help_text)
+
+    def histogram(self, name, help_text="", buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("stage_seconds", "Duration of pipeline stages in seconds.")
+
+
+class Trace:
+    """
+    Timings and values recorded for one unit of work (a query, an ingest run), in order.
+    Stages running concurrently are all recorded, so their sum can exceed total_seconds.
+    """
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.total_seconds = None
+        self.stages = []
+        self.values = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage_name, seconds):
+        with self._lock:
+            self.stages.append((stage_name, seconds))
+
+    def add_value(self, name, value):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def breakdown(self):
+        """Seconds per stage, summed over repeated stages, in first-seen order."""
+        totals = {}
+        with self._lock:
+            for stage_name, seconds in self.stages:
+                totals[stage_name] = totals.get(stage_name, 0.0) + seconds
+        return totals
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "total_seconds": self.total_seconds,
+            "stages": {name: round(seconds, 6) for name, seconds in self.breakdown().items()},
+            "values": dict(self.values),
+            **self.attributes
+        }
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_trace_file_lock = threading.Lock()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def write_trace(finished_trace, path=METRICS_TRACE_PATH):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    line = json.dumps(finished_trace.to_dict(), default=str)
+    with _trace_file_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+@contextmanager
+def trace(name, **attributes):
+    """
+    Collects every stage and value recorded inside the block (also from threads started with
+    submit) into a Trace, which is written to METRICS_TRACE_PATH when the block exits.
+    """
+    new_trace = Trace(name, **attributes)
+    token = _current_trace.set(new_trace)
+    try:
+        yield new_trace
+    finally:
+        _current_trace.reset(token)
+        new_trace.finish()
+        REGISTRY.histogram(f"{name}_seconds", f"Total duration of {name} traces in seconds.").observe(new_trace.total_seconds)
+        write_trace(new_trace)
+
+
+def observe_stage(stage_name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage_name)
+    active = _current_trace.get()
+    if active is not None:
+        active.add_stage(stage_name, seconds)
+
+
+@contextmanager
+def stage(stage_name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage_name, time.perf_counter() - start)
+
+
+def count(name, amount=1, help_text="", **labels):
+    REGISTRY.counter(name, help_text).inc(amount, **labels)
+    active = _current_trace.get()
+    if active is not None:
+        suffix = "".join(f".{value}" for _, value in sorted(labels.items()))
+        active.add_value(name + suffix, amount)
+
+
+def observe(name, value, buckets=SIZE_BUCKETS, help_text=""):
+    REGISTRY.histogram(name, help_text, buckets).observe(value)
+    active = _current_trace.get()
+    if active is not None:
+        active.add_value(name, value)
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit that carries the current trace over to the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    Serves REGISTRY on http://host:port/metrics from a daemon thread. Returns the server,
+    or None when the port is 0 or already taken.
+    """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"⚠️ Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from LLM_search import (encode_e5_queries, encode_clip_queries, collapse_by_article, TEXT_VECTOR, IMAGE_VECTOR,
+                        CHUNK_OVERSAMPLING)
+from vector_store import SearchRequest, open_store, COLLECTION_NAME
+
+QRELS_PATH = "data/qrels.jsonl"
+KS = (1, 5, 10)
+ENCODE_BATCH_SIZE = 64
+# Queries per search_batch call (each query sends a text and an image request).
+SEARCH_BATCH_SIZE = 64
+MODALITIES = ("text", "image")
+# Retrieval settings a config may override; anything else is rejected.
+CONFIG_KEYS = {
+    "backend": str,
+    "collection": str,
+    "hnsw_ef": int,
+    "oversampling": float,
+    "rescore": lambda value: value.lower() in ("1", "true", "yes"),
+    "exact": lambda value: value.lower() in ("1", "true", "yes")
+}
+
+
+def load_qrels(path=QRELS_PATH):
+    """
+    Reads a JSON lines qrels file. Each line holds a query and graded judgments per modality:
+    {"query": "...", "text": {"<article url>": 2, ...}, "image": {"<image path>": 1, ...}}
+    Grades are non-negative numbers; 0 (or a missing document) means not relevant.
+    """
+    qrels = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                qrels.append({
+                    "query": record["query"],
+                    "text": {doc: float(grade) for doc, grade in record.get("text", {}).items()},
+                    "image": {doc: float(grade) for doc, grade in record.get("image", {}).items()}
+                })
+    return qrels
+
+
+def qrels_from_judgments(judgments_path):
+    """
+    Turns the Gemini judgments stored by evaluating.py into qrels, keeping the highest grade
+    given to a document for the same query.
+    """
+    from evaluating import parse_ranked_results
+
+    by_query = {}
+    with open(judgments_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "text_docs" not in record:
+                # Judgments stored before hit identifiers were recorded cannot be mapped to documents.
+                continue
+            texts, images = parse_ranked_results(record["output"])
+            entry = by_query.setdefault(record["query"], {"query": record["query"], "text": {}, "image": {}})
+            for modality, items, docs in (("text", texts, record["text_docs"]), ("image", images, record["image_docs"])):
+                for item in items:
+                    if 1 <= item["id"] <= len(docs) and docs[item["id"] - 1]:
+                        doc = docs[item["id"] - 1]
+                        entry[modality][doc] = max(entry[modality].get(doc, 0.0), item["score"])
+    return list(by_query.values())
+
+
+def save_qrels(qrels, path=QRELS_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for record in qrels:
+            f.write(json.dumps(record) + "\n")
+
+
+def parse_config(spec):
+    """
+    Parses "key=value,key=value" (e.g. "hnsw_ef=128,oversampling=2") into retrieval settings.
+    """
+    config = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        key, _, value = item.partition("=")
+        if key not in CONFIG_KEYS:
+            raise ValueError(f"Unknown config key '{key}', expected one of {sorted(CONFIG_KEYS)}")
+        config[key] = CONFIG_KEYS[key](value)
+    return config
+
+
+def hit_doc(hit, modality):
+    payload = hit.payload or {}
+    if modality == "text":
+        return payload.get("url") or payload.get("article_id", hit.id)
+    return payload.get("image_path", hit.id)
+
+
+def encode_queries(queries, batch_size=ENCODE_BATCH_SIZE):
+    """
+    Returns (e5 vectors, CLIP text vectors) for all queries, encoded in batches with the same
+    functions (prefix, tokenizer, normalisation) the app's query encoders use.
+    """
+    text_vectors, image_vectors = [], []
+    for start in range(0, len(queries), batch_size):
+        batch = list(queries[start:start + batch_size])
+        text_vectors.append(np.asarray(encode_e5_queries(batch), dtype=np.float32))
+        image_vectors.append(np.asarray(encode_clip_queries(batch), dtype=np.float32))
+    return np.concatenate(text_vectors), np.concatenate(image_vectors)
+
+
+def search_all(store, text_vectors, image_vectors, depth, config, batch_size=SEARCH_BATCH_SIZE):
+    """
+    Batched retrieval for every query; returns ranked document ids per modality.
+    """
+    params = {key: config[key] for key in ("hnsw_ef", "oversampling", "rescore", "exact") if key in config}
+    ranked = {"text": [], "image": []}
+    for start in range(0, len(text_vectors), batch_size):
+        requests = []
+        for text_vector, image_vector in zip(text_vectors[start:start + batch_size],
+                                             image_vectors[start:start + batch_size]):
+            requests.append(SearchRequest(TEXT_VECTOR, text_vector, "text", depth * CHUNK_OVERSAMPLING, **params))
+            requests.append(SearchRequest(IMAGE_VECTOR, image_vector, "image", depth, **params))
+        results = store.search_batch(requests)
+        for text_hits, image_hits in zip(results[0::2], results[1::2]):
+            ranked["text"].append([hit_doc(hit, "text") for hit in collapse_by_article(text_hits, depth)])
+            ranked["image"].append([hit_doc(hit, "image") for hit in image_hits])
+    return ranked
+
+
+def grade_matrices(ranked_docs, judgments, depth):
+    """
+    Returns (grades, ideal, n_relevant): the grade of every retrieved rank and the ideal
+    (descending) grades, both zero-padded to (n_queries, depth).
+    """
+    grades = np.zeros((len(ranked_docs), depth), dtype=np.float32)
+    ideal = np.zeros((len(ranked_docs), depth), dtype=np.float32)
+    n_relevant = np.zeros(len(ranked_docs), dtype=np.int64)
+    for i, (docs, judged) in enumerate(zip(ranked_docs, judgments)):
+        row = [judged.get(doc, 0.0) for doc in docs[:depth]]
+        grades[i, :len(row)] = row
+        relevant = sorted((grade for grade in judged.values() if grade > 0), reverse=True)
+        ideal[i, :min(len(relevant), depth)] = relevant[:depth]
+        n_relevant[i] = len(relevant)
+    return grades, ideal, n_relevant
+
+
+def ranking_metrics(grades, ideal, n_relevant, ks=KS):
+    """
+    Per-query recall@k, precision@k, nDCG@k (exponential gain) and MRR@k as arrays of shape
+    (n_queries,). Queries without any relevant document get NaN and drop out of the means.
+    """
+    discounts = 1.0 / np.log2(np.arange(grades.shape[1]) + 2)
+    relevant = grades > 0
+    has_relevant = n_relevant > 0
+    metrics = {}
+    for k in ks:
+        hits = relevant[:, :k]
+        hit_count = hits.sum(axis=1)
+        dcg = ((2.0 ** grades[:, :k] - 1) * discounts[:k]).sum(axis=1)
+        idcg = ((2.0 ** ideal[:, :k] - 1) * discounts[:k]).sum(axis=1)
+        first = hits.argmax(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            metrics[f"recall@{k}"] = np.where(has_relevant, hit_count / np.maximum(n_relevant, 1), np.nan)
+            metrics[f"precision@{k}"] = np.where(has_relevant, hit_count / k, np.nan)
+            metrics[f"ndcg@{k}"] = np.where(has_relevant, dcg / np.where(idcg > 0, idcg, 1), np.nan)
+            metrics[f"mrr@{k}"] = np.where(has_relevant, np.where(hits.any(axis=1), 1.0 / (first + 1), 0.0), np.nan)
+    return metrics
+
+
+def evaluate_config(qrels, config, ks=KS, vectors=None, store=None):
+    """
+    Runs every qrels query against one retrieval configuration. vectors (from encode_queries)
+    can be shared between configs that use the same encoders.
+    """
+    queries = [record["query"] for record in qrels]
+    depth = max(ks)
+    start = time.perf_counter()
+    text_vectors, image_vectors = vectors if vectors is not None else encode_queries(queries)
+    encode_seconds = time.perf_counter() - start
+
+    store = store or open_store(config.get("backend"), collection_name=config.get("collection", COLLECTION_NAME))
+    start = time.perf_counter()
+    ranked = search_all(store, text_vectors, image_vectors, depth, config)
+    search_seconds = time.perf_counter() - start
+
+    per_query, summary = {}, {}
+    for modality in MODALITIES:
+        grades, ideal, n_relevant = grade_matrices(ranked[modality], [record[modality] for record in qrels], depth)
+        per_query[modality] = ranking_metrics(grades, ideal, n_relevant, ks)
+        judged = int((n_relevant > 0).sum())
+        summary[modality] = {"queries": judged}
+        summary[modality].update({
+            name: round(float(np.nanmean(values)), 4) if judged else None
+            for name, values in per_query[modality].items()
+        })
+    summary["timing"] = {
+        "queries": len(queries),
+        "encode_s": round(encode_seconds, 3),
+        "search_s": round(search_seconds, 3),
+        "search_qps": round(len(queries) / search_seconds, 1) if search_seconds else None
+    }
+    return summary, per_query
+
+
+def compare_configs(per_query_a, per_query_b, metric):
+    """
+    Paired per-query comparison of one metric: mean difference (b - a) and wins/ties/losses of b.
+    """
+    comparison = {}
+    for modality in MODALITIES:
+        a, b = per_query_a[modality][metric], per_query_b[modality][metric]
+        judged = ~np.isnan(a) & ~np.isnan(b)
+        diff = b[judged] - a[judged]
+        comparison[modality] = {
+            "metric": metric,
+            "mean_delta": round(float(diff.mean()), 4) if judged.any() else None,
+            "wins": int((diff > 1e-9).sum()),
+            "ties": int((np.abs(diff) <= 1e-9).sum()),
+            "losses": int((diff < -1e-9).sum())
+        }
+    return comparison
+
+
+def output_summary(labels, summaries, comparison=None):
+    for modality in MODALITIES:
+        print(f"\n📊 {modality.capitalize()} retrieval ({summaries[0][modality]['queries']} judged queries)")
+        metric_names = [name for name in summaries[0][modality] if name != "queries"]
+        print(f"{'metric':<14}" + "".join(f"{label[:20]:>22}" for label in labels)
+              + (f"{'Δ':>10}" if len(summaries) == 2 else ""))
+        for name in metric_names:
+            values = [summary[modality][name] for summary in summaries]
+            row = f"{name:<14}" + "".join(f"{'-' if value is None else value:>22}" for value in values)
+            if len(values) == 2 and None not in values:
+                row += f"{values[1] - values[0]:>+10.4f}"
+            print(row)
+    for label, summary in zip(labels, summaries):
+        print(f"\n⏱️ {label}: {summary['timing']}")
+    if comparison:
+        for modality, result in comparison.items():
+            print(f"⚖️ {modality} {result['metric']}: Δ {result['mean_delta']} "
+                  f"(wins {result['wins']}, ties {result['ties']}, losses {result['losses']})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline retrieval evaluation against stored relevance judgments (qrels).")
+    parser.add_argument('--qrels', type=str, default=QRELS_PATH, help='JSON lines qrels file')
+    parser.add_argument('--build-from-judgments', type=str, default=None,
+                        help='Write qrels built from evaluating.py judgments (e.g. data/eval_judgments.jsonl) to --qrels and exit')
+    parser.add_argument('--config', type=str, default="",
+                        help='Retrieval settings, e.g. "hnsw_ef=128,oversampling=2" (keys: %s)' % ", ".join(CONFIG_KEYS))
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Second configuration to evaluate side by side with --config')
+    parser.add_argument('--k', type=int, nargs='+', default=list(KS), help='Cut-offs')
+    parser.add_argument('--output', type=str, default=None, help='Write the summaries as JSON to this file')
+    args = parser.parse_args()
+
+    if args.build_from_judgments:
+        qrels = qrels_from_judgments(args.build_from_judgments)
+        save_qrels(qrels, args.qrels)
+        print(f"✅ Wrote {len(qrels)} queries to {args.qrels}")
+        raise SystemExit(0)
+
+    qrels = load_qrels(args.qrels)
+    configs = [parse_config(args.config)] + ([parse_config(args.compare)] if args.compare is not None else [])
+    labels = [args.config or "default"]
+    if args.compare is not None:
+        labels = [f"A: {labels[0]}", f"B: {args.compare or 'default'}"]
+
+    print(f"🔎 Encoding {len(qrels)} queries")
+    vectors = encode_queries([record["query"] for record in qrels])
+    results = [evaluate_config(qrels, config, args.k, vectors) for config in configs]
+    summaries = [summary for summary, _ in results]
+    comparison = compare_configs(results[0][1], results[1][1], f"ndcg@{max(args.k)}") if len(results) == 2 else None
+
+    output_summary(labels, summaries, comparison)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"configs": dict(zip(labels, summaries)), "comparison": comparison}, f, indent=2)
@@ -0,0 +1,45 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces calls at least 1 / rate seconds apart.
+    A rate of 0 or None disables limiting.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HostRateLimiter:
+    """
+    Keeps one RateLimiter per host, so concurrent workers stay polite to each site.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = RateLimiter(self.rate)
+        limiter.wait()
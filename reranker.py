@@ -0,0 +1,54 @@
+import re
+
+
+class CrossEncoderTextReranker:
+    """
+    Scores (query, title + passage) pairs with a sentence-transformers cross-encoder.
+    """
+
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", max_length=512):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, max_length=max_length)
+
+    def scores(self, query, hits):
+        if not hits:
+            return []
+        pairs = [
+            (query, f"{hit.payload.get('title', '')}. {hit.payload.get('content', '')}")
+            for hit in hits
+        ]
+        return [float(score) for score in self.model.predict(pairs)]
+
+
+class ClipImageReranker:
+    """
+    Orders image hits by CLIP similarity to the query. Qdrant already returns the cosine
+    similarity between the CLIP query vector and the stored image vector as hit.score,
+    so no extra forward pass is needed.
+    """
+
+    def scores(self, query, hits):
+        return [float(hit.score) for hit in hits]
+
+
+class StubReranker:
+    """
+    Model-free reranker for tests and benchmarks: scores hits by query word overlap with their title and content.
+    """
+
+    def scores(self, query, hits):
+        query_words = set(re.findall(r"\w+", query.lower()))
+        scores = []
+        for hit in hits:
+            words = set(re.findall(r"\w+", f"{hit.payload.get('title', '')} {hit.payload.get('content', '')}".lower()))
+            scores.append(len(query_words & words) / (len(query_words) or 1))
+        return scores
+
+
+def rerank(reranker, query, hits, top_k):
+    """
+    Returns the top_k hits ordered by the reranker's scores (ties keep retrieval order).
+    """
+    scores = reranker.scores(query, hits)
+    order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)
+    return [hits[i] for i in order[:top_k]]
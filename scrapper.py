@@ -3,10 +3,21 @@ from bs4 import BeautifulSoup
 import pandas as pd
 from urllib.parse import urljoin
 import os
-import time
+import json
+import hashlib
+import argparse
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 import time
 
+from atomic_io import atomic_write
+from corpus import ARTICLES_PATH, write_corpus
+from dedup import normalize_url
+from rate_limiter import HostRateLimiter
+
 HEADERS = {
     "User-Agent": (
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -15,53 +26,163 @@ HEADERS = {
     )
 }
 
+CRAWL_CONCURRENCY = 8
+REQUESTS_PER_SECOND_PER_HOST = 4
+HTTP_CACHE_DIR = "data/http_cache"
+
+CachedResponse = namedtuple("CachedResponse", ["status_code", "text", "from_cache"])
+
+
+class HttpCache:
+    """
+    On-disk cache of successful GET responses with their ETag / Last-Modified validators.
+    """
+
+    def __init__(self, cache_dir=HTTP_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def get(self, url):
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, response):
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "text": response.text
+        }
+        # Crawler threads can fetch the same URL at once, so each writes its own temporary file.
+        atomic_write(self._path(url), lambda f: json.dump(entry, f), suffix=f".{threading.get_ident()}.tmp")
+
+
+class Crawler:
+    """
+    Shared fetcher for the scraping functions: pooled keep-alive session, per-host rate limit,
+    bounded concurrency and an optional on-disk HTTP cache revalidated with conditional GETs.
+    """
+
+    def __init__(self, concurrency=CRAWL_CONCURRENCY, rate_per_host=REQUESTS_PER_SECOND_PER_HOST,
+                 cache_dir=HTTP_CACHE_DIR):
+        self.concurrency = concurrency
+        self.limiter = HostRateLimiter(rate_per_host)
+        self.cache = HttpCache(cache_dir) if cache_dir else None
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url, timeout=10):
+        cached = self.cache.get(url) if self.cache else None
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        self.limiter.wait(url)
+        response = self.session.get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached:
+            return CachedResponse(200, cached["text"], True)
+        if response.status_code == 200 and self.cache:
+            self.cache.put(url, response)
+        return CachedResponse(response.status_code, response.text, False)
+
+    def map(self, fn, items):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            yield from executor.map(fn, items)
+
+
+_default_crawler = None
 
-def fetch_all_tag_urls():
+
+def get_crawler():
+    global _default_crawler
+    if _default_crawler is None:
+        _default_crawler = Crawler()
+    return _default_crawler
+
+
+SKIPPED_TAGS = [
+    '/tag/letters/', '/tag/data-points/', '/tag/research/',
+    '/tag/business/', '/tag/science/', '/tag/culture/',
+    '/tag/hardware/', '/tag/ai-careers/'
+]
+
+
+def _tag_links_on_page(crawler, url):
+    try:
+        response = crawler.fetch(url)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        return None
+    if response.status_code != 200:
+        return None
+    soup = BeautifulSoup(response.text, 'html.parser')
+    links = set()
+    for link in soup.find_all('a', href=True):
+        href = link['href']
+        if '/the-batch/tag/' in href and not any(skip in href for skip in SKIPPED_TAGS):
+            links.add(urljoin(url, href))
+    return links
+
+
+def fetch_all_tag_urls(crawler=None):
+    crawler = crawler or get_crawler()
     base_url = "https://www.deeplearning.ai/the-batch/"
     all_tag_urls = set()
     page_num = 1
+    # Listing pages are fetched a window at a time; the crawl stops at the first page
+    # that is missing or contributes no new tags, exactly like the serial version.
     while True:
-        url = f"{base_url}page/{page_num}/"
-        response = requests.get(url, headers=HEADERS)
+        page_urls = [f"{base_url}page/{n}/" for n in range(page_num, page_num + crawler.concurrency)]
+        for page_links in crawler.map(lambda url: _tag_links_on_page(crawler, url), page_urls):
+            if page_links is None:
+                return list(all_tag_urls)
+            new_links = page_links - all_tag_urls
+            if not new_links:
+                return list(all_tag_urls)
+            all_tag_urls |= new_links
+        page_num += crawler.concurrency
+
+
+def _article_links_on_tag_page(crawler, tag_url):
+    links = set()
+    try:
+        response = crawler.fetch(tag_url)
         if response.status_code != 200:
-            break
+            return links
         soup = BeautifulSoup(response.text, 'html.parser')
-        links_found = 0
         for link in soup.find_all('a', href=True):
             href = link['href']
-            if '/the-batch/tag/' in href and not any(skip in href for skip in [
-                '/tag/letters/', '/tag/data-points/', '/tag/research/',
-                '/tag/business/', '/tag/science/', '/tag/culture/',
-                '/tag/hardware/', '/tag/ai-careers/'
-            ]):
-                full_url = urljoin(base_url, href)
-                if full_url not in all_tag_urls:
-                    all_tag_urls.add(full_url)
-                    links_found += 1
-        if links_found == 0:
-            break
-        page_num += 1
-        time.sleep(0.25)
-    return list(all_tag_urls)
-
-
-def get_valid_article_links():
+            if '/the-batch/' in href and '/tag/' not in href and '/issue-' not in href:
+                # Normalised, so the same article linked with a fragment, tracking query or without
+                # the trailing slash is only scraped once.
+                links.add(normalize_url(urljoin(tag_url, href)))
+    except Exception as e:
+        print(f"Error fetching {tag_url}: {e}")
+    return links
+
+
+def get_valid_article_links(crawler=None):
+    crawler = crawler or get_crawler()
     article_links = set()
-    tag_urls = fetch_all_tag_urls()
-    for tag_url in tqdm(tag_urls, desc="Scanning tag pages"):
-        try:
-            response = requests.get(tag_url, headers=HEADERS)
-            if response.status_code != 200:
-                continue
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for link in soup.find_all('a', href=True):
-                href = link['href']
-                if '/the-batch/' in href and '/tag/' not in href and '/issue-' not in href:
-                    full_url = urljoin(tag_url, href)
-                    article_links.add(full_url)
-        except Exception as e:
-            print(f"Error fetching {tag_url}: {e}")
-        time.sleep(0.25)
+    tag_urls = fetch_all_tag_urls(crawler)
+    for links in tqdm(crawler.map(lambda url: _article_links_on_tag_page(crawler, url), tag_urls),
+                      total=len(tag_urls), desc="Scanning tag pages"):
+        article_links |= links
     return list(article_links)
 
 
@@ -77,10 +198,11 @@ def is_unwanted_image(url: str) -> bool:
     )
 
 
-def extract_article_data(article_url, retries=3, delay=2):
+def extract_article_data(article_url, retries=3, delay=2, crawler=None):
+    crawler = crawler or get_crawler()
     for attempt in range(retries):
         try:
-            response = requests.get(article_url, headers=HEADERS, timeout=10)
+            response = crawler.fetch(article_url)
             if response.status_code == 200:
                 break
             else:
@@ -123,24 +245,37 @@ def extract_article_data(article_url, retries=3, delay=2):
         return None
 
 
-def scrape_the_batch_articles(limit=None):
-    article_links = get_valid_article_links()
+def scrape_the_batch_articles(limit=None, crawler=None):
+    crawler = crawler or get_crawler()
+    article_links = get_valid_article_links(crawler)
     if limit:
         article_links = article_links[:limit]
     articles = []
     skipped = 0
-    for url in tqdm(article_links, desc="Scraping articles"):
-        data = extract_article_data(url)
+    results = crawler.map(lambda url: extract_article_data(url, crawler=crawler), article_links)
+    for data in tqdm(results, total=len(article_links), desc="Scraping articles"):
         if data:
             articles.append(data)
         else:
             skipped += 1
     print(f"✅ Зібрано {len(articles)} статей, пропущено {skipped}")
-    return pd.DataFrame(articles)
+    return pd.DataFrame(articles, columns=["url", "title", "content", "media_urls"])
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape The Batch articles.")
+    parser.add_argument('--concurrency', type=int, default=CRAWL_CONCURRENCY, help='Number of concurrent requests')
+    parser.add_argument('--rate', type=float, default=REQUESTS_PER_SECOND_PER_HOST,
+                        help='Maximum requests per second per host')
+    parser.add_argument('--no-cache', action='store_true', help=f'Do not use the HTTP cache in {HTTP_CACHE_DIR}')
+    args = parser.parse_args()
+
     os.makedirs("data", exist_ok=True)
-    df = scrape_the_batch_articles()
-    df.to_csv("data/the_batch_articles.csv", index=False)
-    print("Scraping complete. Articles saved to data/the_batch_articles.csv")
+    crawler = Crawler(
+        concurrency=args.concurrency,
+        rate_per_host=args.rate,
+        cache_dir=None if args.no_cache else HTTP_CACHE_DIR
+    )
+    df = scrape_the_batch_articles(crawler=crawler)
+    write_corpus(df, ARTICLES_PATH)
+    print(f"Scraping complete. Articles saved to {ARTICLES_PATH}")
@@ -0,0 +1,19 @@
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_each_caller_gets_its_own_row():
+    batcher = MicroBatcher("test", lambda items: [item * 2 for item in items], max_wait_ms=20)
+
+    assert batcher.encode_many([1, 2, 3]) == [2, 4, 6]
+
+
+def test_short_encoder_output_fails_every_caller_instead_of_hanging():
+    batcher = MicroBatcher("test", lambda items: [0] * (len(items) - 1), max_wait_ms=20)
+
+    futures = batcher.submit_many(["a", "b", "c"])
+
+    for future in futures:
+        with pytest.raises(ValueError, match="2 vectors for 3 inputs"):
+            future.result(timeout=5)
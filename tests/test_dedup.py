@@ -0,0 +1,37 @@
+from dedup import ImageHashIndex, informative_dhash
+
+STRUCTURED = 0x0F0F_0F0F_F0F0_F0F0
+
+
+def make_index(tmp_path, images):
+    """images: {name: (dhash, pixels, bytes)}; writes the files and indexes them with the given hashes."""
+    index = ImageHashIndex((tmp_path / "image_hashes.json").as_posix())
+    for name, (value, pixels, data) in images.items():
+        path = tmp_path / name
+        path.write_bytes(data)
+        index._entries[path.as_posix()] = {"sha256": data.hex(), "dhash": format(value, "016x"),
+                                           "pixels": pixels, "size": len(data), "mtime_ns": 0}
+    return index, {name: (tmp_path / name).as_posix() for name in images}
+
+
+def test_near_duplicates_match_the_canonical_copy_not_a_chain(tmp_path):
+    index, paths = make_index(tmp_path, {
+        "large.jpg": (STRUCTURED, 400, b"a"),
+        "close.jpg": (STRUCTURED ^ 0b111, 300, b"b"),
+        "drifted.jpg": (STRUCTURED ^ 0b111111, 200, b"c"),
+    })
+
+    assert index.dedupe(max_distance=3) == {paths["close.jpg"]: paths["large.jpg"]}
+    assert index.canonical(paths["drifted.jpg"]) == paths["drifted.jpg"]
+
+
+def test_low_entropy_hashes_only_match_exact_copies(tmp_path):
+    index, paths = make_index(tmp_path, {
+        "blank.png": (0x0, 100, b"a"),
+        "almost_blank.png": (0x1, 100, b"b"),
+        "blank_copy.png": (0x0, 50, b"a"),
+    })
+
+    assert not informative_dhash(0x1)
+    assert informative_dhash(STRUCTURED)
+    assert index.dedupe(max_distance=3) == {paths["blank_copy.png"]: paths["blank.png"]}
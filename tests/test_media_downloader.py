@@ -0,0 +1,96 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from media_downloader import download_file, make_session, media_filepath
+
+BODY = os.urandom(200 * 1024)
+ETAG = '"v1"'
+
+
+class MediaServer:
+    """Local stand-in for the media host. Set truncate to drop the connection halfway through a body."""
+
+    def __init__(self):
+        self.requests = []
+        self.truncate = False
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                if self.headers.get("If-None-Match") == ETAG:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(BODY)))
+                self.send_header("ETag", ETAG)
+                self.end_headers()
+                if server.truncate:
+                    self.wfile.write(BODY[:len(BODY) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(BODY)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.httpd.server_port}/{name}"
+
+
+@pytest.fixture
+def server():
+    media_server = MediaServer()
+    media_server.thread.start()
+    yield media_server
+    media_server.httpd.shutdown()
+    media_server.httpd.server_close()
+
+
+def test_downloads_and_skips_existing_file(server, tmp_path):
+    session = make_session(pool_size=2)
+    url = server.url("image.jpg")
+
+    path = download_file(session, url, str(tmp_path))
+
+    assert path == media_filepath(url, str(tmp_path)).as_posix()
+    assert open(path, "rb").read() == BODY
+    assert download_file(session, url, str(tmp_path)) == path
+    assert len(server.requests) == 1
+
+
+def test_refresh_sends_etag_and_keeps_file_on_304(server, tmp_path):
+    session = make_session(pool_size=2)
+    url = server.url("chart.png")
+    path = download_file(session, url, str(tmp_path))
+    mtime = os.stat(path).st_mtime_ns
+
+    assert download_file(session, url, str(tmp_path), refresh=True) == path
+    assert server.requests[-1].get("If-None-Match") == ETAG
+    assert os.stat(path).st_mtime_ns == mtime
+    assert open(path, "rb").read() == BODY
+
+
+def test_interrupted_download_leaves_only_part_file_and_next_run_completes(server, tmp_path):
+    session = make_session(pool_size=2)
+    url = server.url("photo.jpg")
+    filepath = media_filepath(url, str(tmp_path))
+    part_path = filepath.with_name(filepath.name + ".part")
+
+    server.truncate = True
+    assert download_file(session, url, str(tmp_path)) is None
+    assert not filepath.exists()
+    assert part_path.exists()
+
+    server.truncate = False
+    assert download_file(session, url, str(tmp_path)) == filepath.as_posix()
+    assert filepath.read_bytes() == BODY
+    assert not part_path.exists()
@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+from reranker import ClipImageReranker, StubReranker, rerank
+
+
+def hit(title, content="", score=0.0):
+    return SimpleNamespace(payload={"title": title, "content": content}, score=score)
+
+
+def test_stub_reranker_reorders_and_truncates():
+    hits = [hit("Chip export rules"), hit("Reinforcement learning", "reward models for learning"),
+            hit("Robotics", "reinforcement learning on robots"), hit("Weekly news")]
+
+    ranked = rerank(StubReranker(), "reinforcement learning", hits, top_k=2)
+
+    assert ranked == [hits[1], hits[2]]
+
+
+def test_rerank_keeps_retrieval_order_on_ties():
+    hits = [hit("a"), hit("b"), hit("c")]
+
+    assert rerank(StubReranker(), "unrelated", hits, top_k=3) == hits
+
+
+def test_clip_image_reranker_orders_by_search_score():
+    hits = [hit("low", score=0.1), hit("high", score=0.9), hit("mid", score=0.5)]
+
+    assert rerank(ClipImageReranker(), "query", hits, top_k=2) == [hits[1], hits[2]]
@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+import pytest
+
+from vector_store import NumpyStore, Point, SearchRequest
+
+
+def make_store(path, n=200, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    store = NumpyStore(path=str(path), collection_name="test")
+    store.create_collection({"text": dim, "image": dim})
+    store.upsert([Point(f"t{i}", {"text": rng.normal(size=dim)}, {"type": "text", "i": i}) for i in range(n)]
+                 + [Point(f"i{i}", {"image": rng.normal(size=dim)}, {"type": "image", "i": i}) for i in range(n)])
+    store.flush()
+    return store
+
+
+def test_search_matches_brute_force_and_filters_type(tmp_path):
+    store = make_store(tmp_path)
+    query = np.random.default_rng(1).normal(size=16)
+
+    hits = store.search("text", query, "text", limit=5)
+
+    matrix = np.asarray(store._matrices["text"], dtype=np.float32)
+    expected = np.argsort(-(matrix @ (query / np.linalg.norm(query))))[:5]
+    assert [hit.id for hit in hits] == [store._ids["text"][row] for row in expected]
+    assert store.search("text", query, "image", limit=5) == []
+
+
+def test_reloads_after_another_instance_writes(tmp_path):
+    reader = make_store(tmp_path)
+    writer = NumpyStore(path=str(tmp_path), collection_name="test")
+    writer.upsert([Point("new", {"text": np.ones(16)}, {"type": "text"})])
+    writer.flush()
+
+    hits = reader.search("text", np.ones(16), "text", limit=1)
+
+    assert hits[0].id == "new"
+    assert reader.count() == 401
+
+
+def test_concurrent_searches_during_writes(tmp_path):
+    store = make_store(tmp_path)
+    rng = np.random.default_rng(2)
+    errors = []
+
+    def search():
+        try:
+            for _ in range(50):
+                results = store.search_batch([SearchRequest("text", rng.normal(size=16), "text", 3),
+                                              SearchRequest("image", rng.normal(size=16), "image", 3)])
+                assert all(len(hits) == 3 for hits in results)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(20):
+        store.upsert([Point(f"t{i}", {"text": rng.normal(size=16)}, {"type": "text"})])
+        store.delete_points([f"i{i}"])
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert store.count() == 380
+
+
+class RecordingPointsStub:
+    """Stands in for the client's gRPC points stub and records what the client sends over the wire."""
+
+    def __init__(self):
+        self.calls = []
+
+    def QueryBatch(self, request, timeout=None):
+        from qdrant_client import grpc
+
+        self.calls.append(("QueryBatch", request, timeout))
+        point = grpc.ScoredPoint(id=grpc.PointId(uuid="00000000-0000-0000-0000-000000000001"), score=0.5,
+                                 version=1)
+        return grpc.QueryBatchResponse(result=[grpc.BatchResult(result=[point]) for _ in request.query_points])
+
+    def Upsert(self, request, timeout=None):
+        from qdrant_client import grpc
+
+        self.calls.append(("Upsert", request, timeout))
+        return grpc.PointsOperationResponse(result=grpc.UpdateResult(operation_id=1,
+                                                                     status=grpc.UpdateStatus.Completed))
+
+
+def test_grpc_search_and_upsert_go_through_the_client(tmp_path):
+    pytest.importorskip("qdrant_client")
+    from qdrant_client import QdrantClient
+    from vector_store import QdrantStore
+
+    client = QdrantClient("localhost", port=1, grpc_port=1, prefer_grpc=True)
+    stub = client._client._grpc_points_client = RecordingPointsStub()
+    store = QdrantStore(client=client, collection_name="test", prefer_grpc=True)
+
+    hits = store.search_batch([SearchRequest("text", np.ones(4), "text", 3),
+                               SearchRequest("image", np.ones(4), "image", 2)])
+    store.upsert([Point("00000000-0000-0000-0000-000000000001", {"text": np.ones(4)}, {"type": "text"})])
+
+    assert [len(result) for result in hits] == [1, 1]
+    assert hits[0][0].score == 0.5
+    (_, query, query_timeout), (_, upsert, upsert_timeout) = stub.calls
+    assert [request.using for request in query.query_points] == ["text", "image"]
+    assert list(query.query_points[0].query.nearest.dense.data) == [1.0] * 4
+    assert list(upsert.points[0].vectors.vectors.vectors["text"].dense.data) == [1.0] * 4
+    assert query_timeout is not None and upsert_timeout is not None
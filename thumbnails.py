@@ -0,0 +1,68 @@
+import os
+from pathlib import Path
+from PIL import Image
+
+from atomic_io import atomic_write
+
+THUMBNAIL_FOLDER = "data/media/thumbs"
+THUMBNAIL_SIZE = (384, 384)
+THUMBNAIL_QUALITY = 80
+
+
+def thumbnail_path(image_path, thumbnail_folder=THUMBNAIL_FOLDER):
+    # Same md5 stem as the original media file, always stored as WebP.
+    return (Path(thumbnail_folder) / (Path(image_path).stem + ".webp")).as_posix()
+
+
+def is_image_file(path):
+    """Whether path has an extension PIL can open; the hash index, temporary files and videos do not."""
+    return os.path.splitext(path)[1].lower() in Image.registered_extensions()
+
+
+def _downscale(image, size=THUMBNAIL_SIZE):
+    image.draft("RGB", size)
+    image = image.convert("RGB")
+    image.thumbnail(size)
+    return image
+
+
+def make_thumbnail(image_path, thumbnail_folder=THUMBNAIL_FOLDER, size=THUMBNAIL_SIZE, overwrite=False):
+    """
+    Writes a fixed-size WebP rendition of image_path and returns its path, or None if the file
+    is not a decodable image (e.g. SVG or video).
+    """
+    target = thumbnail_path(image_path, thumbnail_folder)
+    if not overwrite and os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(image_path):
+        return target
+
+    try:
+        with Image.open(image_path) as image:
+            thumbnail = _downscale(image, size)
+    except Exception as e:
+        print(f"⚠️ Could not create thumbnail for {image_path}: {e}")
+        return None
+
+    atomic_write(target, lambda f: thumbnail.save(f, format="WEBP", quality=THUMBNAIL_QUALITY),
+                 mode="wb", suffix=".part")
+    return target
+
+
+def resolve_thumbnail(image_path, thumbnail_folder=THUMBNAIL_FOLDER):
+    """
+    Returns the stored thumbnail for image_path if there is one, otherwise the original path.
+    """
+    target = thumbnail_path(image_path, thumbnail_folder)
+    return target if os.path.exists(target) else image_path
+
+
+def load_thumbnail(image_path, thumbnail_folder=THUMBNAIL_FOLDER, size=THUMBNAIL_SIZE):
+    """
+    Opens the stored thumbnail for image_path, downscaling the original in memory when none exists.
+    """
+    target = thumbnail_path(image_path, thumbnail_folder)
+    if os.path.exists(target):
+        with Image.open(target) as image:
+            image.load()
+            return image
+    with Image.open(image_path) as image:
+        return _downscale(image, size)
@@ -0,0 +1,737 @@
+import os
+import json
+import argparse
+import itertools
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from atomic_io import atomic_write
+
+COLLECTION_NAME = "articles_collection"
+QDRANT_URL = "http://localhost"
+QDRANT_PORT = 6333
+QDRANT_GRPC_PORT = 6334
+# Searches and upserts go over gRPC (protobuf, packed floats) instead of JSON; QDRANT_PREFER_GRPC=0 switches back to REST.
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "1") != "0"
+# Clients in the shared pool, each with its own connection (gRPC channel), used round-robin by concurrent workers.
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "4"))
+NUMPY_STORE_PATH = "data/vector_store"
+# "qdrant" (default) or "numpy" for the embedded store.
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE", "qdrant")
+
+Point = namedtuple("Point", ["id", "vectors", "payload"])
+SearchHit = namedtuple("SearchHit", ["id", "score", "payload"])
+# hnsw_ef / oversampling / rescore / exact are per-query precision controls; None keeps the collection defaults.
+SearchRequest = namedtuple(
+    "SearchRequest",
+    ["vector_name", "vector", "point_type", "limit", "hnsw_ef", "oversampling", "rescore", "exact"],
+    defaults=(None, None, None, False)
+)
+QUANTIZATION_MODES = (None, "int8", "binary")
+
+
+class VectorStore:
+    """
+    Minimal interface used by ingest_data and LLM_search. Points carry named vectors
+    (e.g. {"text": ...} or {"image": ...}) and a payload with a "type" field.
+    """
+
+    name = None
+
+    def collection_exists(self):
+        raise NotImplementedError
+
+    def create_collection(self, vector_sizes, quantization=None, on_disk=False, hnsw_m=None, hnsw_ef_construct=None):
+        raise NotImplementedError
+
+    def validate_collection(self):
+        pass
+
+    def update_collection(self, quantization=None, on_disk=None, hnsw_m=None, hnsw_ef_construct=None):
+        """Applies index / storage options to an existing collection; backends without them only warn."""
+        print(f"⚠️ {self.name} does not support quantization, on-disk or HNSW options; they are ignored")
+
+    def upsert(self, points):
+        raise NotImplementedError
+
+    def set_payload(self, point_id, payload):
+        """Overwrites the given payload keys of an existing point, leaving its vectors alone."""
+        raise NotImplementedError
+
+    def delete_articles(self, article_ids):
+        raise NotImplementedError
+
+    def delete_points(self, point_ids):
+        raise NotImplementedError
+
+    def point_ids(self):
+        raise NotImplementedError
+
+    def search_batch(self, requests):
+        raise NotImplementedError
+
+    def search(self, vector_name, vector, point_type, limit, **search_params):
+        return self.search_batch([SearchRequest(vector_name, vector, point_type, limit, **search_params)])[0]
+
+    def count(self):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+
+class QdrantClientPool:
+    """
+    Fixed set of QdrantClient instances handed out round-robin. QdrantClient is thread-safe,
+    but a single instance funnels all workers through one connection.
+    """
+
+    def __init__(self, clients, prefer_grpc=False):
+        """
+        prefer_grpc records whether the clients were built for gRPC; local (":memory:") clients are not.
+        """
+        self.clients = list(clients)
+        self.prefer_grpc = prefer_grpc
+        self._next = itertools.count()
+
+    def get(self):
+        return self.clients[next(self._next) % len(self.clients)]
+
+
+_client_pools = {}
+_client_pools_lock = threading.Lock()
+
+
+def get_qdrant_pool(url=QDRANT_URL, port=QDRANT_PORT, grpc_port=QDRANT_GRPC_PORT,
+                    prefer_grpc=QDRANT_PREFER_GRPC, pool_size=QDRANT_POOL_SIZE):
+    """
+    Returns the process-wide client pool for the given server and transport, creating it once.
+    """
+    key = (url, port, grpc_port, prefer_grpc, pool_size)
+    with _client_pools_lock:
+        pool = _client_pools.get(key)
+        if pool is None:
+            import httpx
+            from qdrant_client import QdrantClient
+
+            pool = _client_pools[key] = QdrantClientPool(
+                [
+                    QdrantClient(
+                        url, port=port, grpc_port=grpc_port, prefer_grpc=prefer_grpc,
+                        # Keep the REST connection alive between requests (the client disables this for localhost).
+                        limits=httpx.Limits(max_connections=None, max_keepalive_connections=1)
+                    )
+                    for _ in range(max(pool_size, 1))
+                ],
+                prefer_grpc=prefer_grpc
+            )
+        return pool
+
+
+class QdrantStore(VectorStore):
+
+    def __init__(self, client=None, collection_name=COLLECTION_NAME, prefer_grpc=None, pool_size=None, pool=None):
+        """
+        Uses the given client, else the given pool, else the shared pool from get_qdrant_pool.
+        Pass prefer_grpc=True with a client that was itself created with prefer_grpc=True.
+        """
+        if client is not None:
+            self._pool = QdrantClientPool([client], prefer_grpc=bool(prefer_grpc))
+        elif pool is not None:
+            self._pool = pool
+        else:
+            self._pool = get_qdrant_pool(
+                prefer_grpc=QDRANT_PREFER_GRPC if prefer_grpc is None else prefer_grpc,
+                pool_size=pool_size or QDRANT_POOL_SIZE
+            )
+        self.collection_name = collection_name
+        self.name = collection_name
+
+    @property
+    def client(self):
+        return self._pool.get()
+
+    @property
+    def prefer_grpc(self):
+        return self._pool.prefer_grpc
+
+    def collection_exists(self):
+        return self.client.collection_exists(self.collection_name)
+
+    def create_collection(self, vector_sizes, quantization=None, on_disk=False, hnsw_m=None, hnsw_ef_construct=None):
+        """
+        quantization is None, "int8" (scalar) or "binary"; the quantized vectors are kept in RAM
+        while the originals can be moved to disk with on_disk and are used for rescoring.
+        """
+        from qdrant_client import models as rest
+
+        quantization_config = self._quantization_config(quantization)
+        hnsw_config = self._hnsw_config(hnsw_m, hnsw_ef_construct)
+        self.client.recreate_collection(
+            collection_name=self.collection_name,
+            vectors_config={
+                name: rest.VectorParams(
+                    size=size,
+                    distance=rest.Distance.COSINE,
+                    on_disk=on_disk or None,
+                    hnsw_config=hnsw_config,
+                    quantization_config=quantization_config
+                )
+                for name, size in vector_sizes.items()
+            }
+        )
+
+    @staticmethod
+    def _quantization_config(quantization):
+        from qdrant_client import models as rest
+
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        if quantization == "int8":
+            return rest.ScalarQuantization(scalar=rest.ScalarQuantizationConfig(
+                type=rest.ScalarType.INT8, quantile=0.99, always_ram=True
+            ))
+        if quantization == "binary":
+            return rest.BinaryQuantization(binary=rest.BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    @staticmethod
+    def _hnsw_config(hnsw_m, hnsw_ef_construct):
+        from qdrant_client import models as rest
+
+        if hnsw_m is None and hnsw_ef_construct is None:
+            return None
+        return rest.HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct)
+
+    def update_collection(self, quantization=None, on_disk=None, hnsw_m=None, hnsw_ef_construct=None):
+        """
+        Changes the options of every named vector in place; only the options that are given change.
+        Qdrant rebuilds the affected indexes / quantized vectors in the background.
+        """
+        from qdrant_client import models as rest
+
+        vector_names = self.client.get_collection(self.collection_name).config.params.vectors
+        diff = rest.VectorParamsDiff(
+            hnsw_config=self._hnsw_config(hnsw_m, hnsw_ef_construct),
+            quantization_config=self._quantization_config(quantization),
+            on_disk=on_disk
+        )
+        self.client.update_collection(
+            collection_name=self.collection_name,
+            vectors_config={name: diff for name in vector_names}
+        )
+
+    def validate_collection(self):
+        from qdrant_client import models as rest
+
+        info = self.client.get_collection(self.collection_name)
+        if not isinstance(info.config.params.vectors, dict):
+            raise ValueError(
+                f"Collection '{self.collection_name}' uses a single unnamed vector; "
+                f"delete it and re-run ingestion to create the named-vector layout"
+            )
+        # Keyword index on "type" keeps the filtered HNSW searches fast as the collection grows;
+        # "article_id" is used to replace all chunks of an article when it changes.
+        for field_name in ("type", "article_id"):
+            if field_name not in (info.payload_schema or {}):
+                self.client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=field_name,
+                    field_schema=rest.PayloadSchemaType.KEYWORD
+                )
+
+    def upsert(self, points):
+        from qdrant_client import models as rest
+
+        if not points:
+            return
+        if self.prefer_grpc:
+            self._upsert_grpc(points)
+            return
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=[
+                rest.PointStruct(
+                    id=point.id,
+                    vector={name: np.asarray(vector).tolist() for name, vector in point.vectors.items()},
+                    payload=point.payload
+                )
+                for point in points
+            ]
+        )
+
+    def _upsert_grpc(self, points):
+        from qdrant_client import grpc
+        from qdrant_client.conversions.conversion import RestToGrpc, payload_to_grpc
+
+        # Protobuf packs the floats as 4 bytes each; one tolist() per vector is the cheapest way to fill them.
+        # The client passes prebuilt gRPC points straight through, with its own timeout and api-key metadata.
+        self.client.upsert(
+            collection_name=self.collection_name,
+            wait=True,
+            points=[
+                grpc.PointStruct(
+                    id=RestToGrpc.convert_extended_point_id(point.id),
+                    vectors=grpc.Vectors(vectors=grpc.NamedVectors(vectors={
+                        name: grpc.Vector(dense=grpc.DenseVector(data=np.asarray(vector, dtype=np.float32).tolist()))
+                        for name, vector in point.vectors.items()
+                    })),
+                    payload=payload_to_grpc(point.payload or {})
+                )
+                for point in points
+            ]
+        )
+
+    def set_payload(self, point_id, payload):
+        self.client.set_payload(collection_name=self.collection_name, payload=payload, points=[point_id])
+
+    def delete_articles(self, article_ids):
+        from qdrant_client import models as rest
+
+        if not article_ids:
+            return
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=rest.FilterSelector(filter=rest.Filter(
+                must=[rest.FieldCondition(key="article_id", match=rest.MatchAny(any=list(article_ids)))]
+            ))
+        )
+        # Points from before chunking used the article id itself.
+        self.delete_points(article_ids)
+
+    def delete_points(self, point_ids):
+        from qdrant_client import models as rest
+
+        if not point_ids:
+            return
+        self.client.delete(collection_name=self.collection_name,
+                           points_selector=rest.PointIdsList(points=list(point_ids)))
+
+    def _search_params(self, request):
+        from qdrant_client import models as rest
+
+        quantization = None
+        if request.oversampling is not None or request.rescore is not None:
+            quantization = rest.QuantizationSearchParams(rescore=request.rescore, oversampling=request.oversampling)
+        if request.hnsw_ef is None and quantization is None and not request.exact:
+            return None
+        return rest.SearchParams(hnsw_ef=request.hnsw_ef, exact=request.exact, quantization=quantization)
+
+    def _query_request(self, request):
+        from qdrant_client import models as rest
+
+        return rest.QueryRequest(
+            query=np.asarray(request.vector).tolist(),
+            using=request.vector_name,
+            limit=request.limit,
+            filter=rest.Filter(
+                must=[rest.FieldCondition(key="type", match=rest.MatchValue(value=request.point_type))]
+            ),
+            params=self._search_params(request),
+            with_payload=True
+        )
+
+    def search_batch(self, requests):
+        # The client converts REST requests to gRPC itself when it was built with prefer_grpc;
+        # it cannot take prebuilt gRPC QueryPoints, since it rewrites each request's query field.
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[self._query_request(request) for request in requests]
+        )
+        return [response.points for response in responses]
+
+    def count(self):
+        return self.client.get_collection(self.collection_name).points_count
+
+    def point_ids(self, batch_size=1024):
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False
+            )
+            for record in records:
+                yield record.id
+            if offset is None:
+                break
+
+    def scroll(self, batch_size=256):
+        """Yields every point of the collection as a Point, with vectors."""
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            for record in records:
+                vectors = record.vector
+                if not isinstance(vectors, dict):
+                    # Old single-vector layout: the payload type tells which space the vector is in.
+                    vectors = {record.payload.get("type", "text"): vectors}
+                yield Point(record.id, vectors, record.payload)
+            if offset is None:
+                break
+
+
+class NumpyStore(VectorStore):
+    """
+    Embedded vector store: one memory-mapped .npy matrix per named vector plus JSON sidecars
+    for point ids and payloads. Vectors are L2-normalised on insert, so the dot product is the
+    cosine similarity Qdrant would return.
+
+    Search is exact and vectorised over all queries of a batch. With ivf_lists set, saving
+    also clusters each matrix into that many k-means partitions and searches probe only the
+    nprobe closest ones, which trades a little recall for speed on larger corpora.
+    Precision is chosen with dtype; the Qdrant HNSW / quantization options are ignored here,
+    and exact=True in a request skips the IVF partitions.
+
+    Writers replace matrices, id lists and the payload dict instead of mutating them, so searches
+    only hold the lock to take a snapshot and score outside it. When another process (ingest)
+    rewrites the files, the next search or count sees the new meta.json mtime and reloads.
+    """
+
+    def __init__(self, path=NUMPY_STORE_PATH, collection_name=COLLECTION_NAME, dtype="float32",
+                 ivf_lists=None, nprobe=8, block_rows=65536):
+        self.path = os.path.join(path, collection_name)
+        self.collection_name = collection_name
+        self.name = f"numpy:{collection_name}"
+        self.dtype = np.dtype(dtype)
+        self.ivf_lists = ivf_lists
+        self.nprobe = nprobe
+        self.block_rows = block_rows
+        self._lock = threading.RLock()
+        self._meta = None
+        self._matrices = {}
+        self._ids = {}
+        self._row_of = {}
+        self._type_masks = {}
+        self._ivf = {}
+        self._payloads = {}
+        self._dirty = False
+        self._loaded_stamp = None
+        if os.path.exists(self._file("meta.json")):
+            self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        self._loaded_stamp = self._meta_stamp()
+        with open(self._file("meta.json"), encoding="utf-8") as f:
+            self._meta = json.load(f)
+        self.dtype = np.dtype(self._meta["dtype"])
+        with open(self._file("payloads.json"), encoding="utf-8") as f:
+            self._payloads = json.load(f)
+        self._matrices, self._ids, self._ivf = {}, {}, {}
+        for name, size in self._meta["vectors"].items():
+            matrix_path = self._file(f"{name}.npy")
+            if os.path.exists(matrix_path):
+                self._matrices[name] = np.load(matrix_path, mmap_mode="r")
+                with open(self._file(f"{name}_ids.json"), encoding="utf-8") as f:
+                    self._ids[name] = json.load(f)
+            else:
+                self._matrices[name] = np.zeros((0, size), dtype=self.dtype)
+                self._ids[name] = []
+            ivf_path = self._file(f"{name}_ivf.npz")
+            if os.path.exists(ivf_path):
+                ivf = np.load(ivf_path)
+                self._ivf[name] = (ivf["centroids"], ivf["assignments"])
+            self._reindex(name)
+
+    def _reindex(self, name):
+        ids = self._ids[name]
+        self._row_of[name] = {point_id: row for row, point_id in enumerate(ids)}
+        types = np.array([self._payloads[point_id].get("type", "") for point_id in ids], dtype=object)
+        # One boolean mask per payload type, built once per write instead of compared per query.
+        self._type_masks[name] = {point_type: types == point_type for point_type in set(types.tolist())}
+
+    def _meta_stamp(self):
+        # meta.json is replaced (new inode) last on every flush, so this changes once per save.
+        stat = os.stat(self._file("meta.json"))
+        return stat.st_mtime_ns, stat.st_ino
+
+    def _refresh(self):
+        # Callers hold self._lock. Local unflushed writes win over the files on disk.
+        if self._dirty:
+            return
+        try:
+            stamp = self._meta_stamp()
+        except OSError:
+            return
+        if stamp != self._loaded_stamp:
+            self._load()
+
+    def collection_exists(self):
+        with self._lock:
+            self._refresh()
+            return self._meta is not None
+
+    def create_collection(self, vector_sizes, quantization=None, on_disk=False, hnsw_m=None, hnsw_ef_construct=None):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            for name in os.listdir(self.path):
+                os.remove(self._file(name))
+            self._meta = {"dtype": self.dtype.name, "vectors": dict(vector_sizes)}
+            self._payloads = {}
+            self._matrices = {name: np.zeros((0, size), dtype=self.dtype) for name, size in vector_sizes.items()}
+            self._ids = {name: [] for name in vector_sizes}
+            self._ivf = {}
+            for name in vector_sizes:
+                self._reindex(name)
+            self._dirty = True
+            self.flush()
+
+    def upsert(self, points):
+        with self._lock:
+            self._refresh()
+            # Copy-on-write: searches may still be scoring the previous matrices and payloads.
+            payloads = dict(self._payloads)
+            appended = {name: ([], []) for name in self._meta["vectors"]}
+            updated = {name: {} for name in self._meta["vectors"]}
+            for point in points:
+                point_id = str(point.id)
+                payloads[point_id] = point.payload
+                for name, vector in point.vectors.items():
+                    vector = np.asarray(vector, dtype=np.float32)
+                    vector = (vector / (np.linalg.norm(vector) or 1.0)).astype(self.dtype)
+                    row = self._row_of[name].get(point_id)
+                    if row is None:
+                        appended[name][0].append(point_id)
+                        appended[name][1].append(vector)
+                    else:
+                        updated[name][row] = vector
+
+            self._payloads = payloads
+            for name in self._meta["vectors"]:
+                new_ids, new_vectors = appended[name]
+                if updated[name]:
+                    matrix = np.array(self._matrices[name])
+                    rows = list(updated[name])
+                    matrix[rows] = np.stack([updated[name][row] for row in rows])
+                    self._matrices[name] = matrix
+                if new_ids:
+                    self._matrices[name] = np.concatenate([np.asarray(self._matrices[name]), np.stack(new_vectors)])
+                    self._ids[name] = self._ids[name] + new_ids
+                    self._ivf.pop(name, None)
+                self._reindex(name)
+            self._dirty = True
+
+    def set_payload(self, point_id, payload):
+        with self._lock:
+            self._refresh()
+            point_id = str(point_id)
+            if point_id not in self._payloads:
+                return
+            # Copy-on-write, as in upsert.
+            previous = self._payloads[point_id]
+            self._payloads = {**self._payloads, point_id: {**previous, **payload}}
+            if payload.get("type", previous.get("type")) != previous.get("type"):
+                for name in self._meta["vectors"]:
+                    self._reindex(name)
+            self._dirty = True
+
+    def delete_articles(self, article_ids):
+        article_ids = set(article_ids)
+        if not article_ids:
+            return
+        with self._lock:
+            self._refresh()
+            self._drop({
+                point_id for point_id, payload in self._payloads.items()
+                if point_id in article_ids or payload.get("article_id") in article_ids
+            })
+
+    def delete_points(self, point_ids):
+        with self._lock:
+            self._refresh()
+            self._drop(set(point_ids) & self._payloads.keys())
+
+    def point_ids(self):
+        with self._lock:
+            self._refresh()
+            return list(self._payloads)
+
+    def _drop(self, doomed):
+        # Callers hold self._lock.
+        if not doomed:
+            return
+        for name in self._meta["vectors"]:
+            keep = [row for row, point_id in enumerate(self._ids[name]) if point_id not in doomed]
+            if len(keep) != len(self._ids[name]):
+                self._matrices[name] = np.asarray(self._matrices[name])[keep]
+                self._ids[name] = [self._ids[name][row] for row in keep]
+                self._ivf.pop(name, None)
+        self._payloads = {point_id: payload for point_id, payload in self._payloads.items() if point_id not in doomed}
+        for name in self._meta["vectors"]:
+            self._reindex(name)
+        self._dirty = True
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            for name in self._meta["vectors"]:
+                matrix = np.ascontiguousarray(self._matrices[name], dtype=self.dtype)
+                if self.ivf_lists and len(matrix) > self.ivf_lists and name not in self._ivf:
+                    self._ivf[name] = build_ivf(matrix, self.ivf_lists)
+                if name in self._ivf:
+                    centroids, assignments = self._ivf[name]
+                    atomic_write(self._file(f"{name}_ivf.npz"),
+                                 lambda f: np.savez(f, centroids=centroids, assignments=assignments), mode="wb")
+                elif os.path.exists(self._file(f"{name}_ivf.npz")):
+                    os.remove(self._file(f"{name}_ivf.npz"))
+                atomic_write(self._file(f"{name}.npy"), lambda f: np.save(f, matrix), mode="wb")
+                atomic_write(self._file(f"{name}_ids.json"), json.dumps(self._ids[name]))
+                self._matrices[name] = np.load(self._file(f"{name}.npy"), mmap_mode="r")
+            atomic_write(self._file("payloads.json"), json.dumps(self._payloads))
+            atomic_write(self._file("meta.json"), json.dumps(self._meta))
+            self._loaded_stamp = self._meta_stamp()
+            self._dirty = False
+
+    def _snapshot(self):
+        with self._lock:
+            self._refresh()
+            return dict(self._matrices), dict(self._ids), dict(self._type_masks), dict(self._ivf), self._payloads
+
+    def _scores(self, matrix, queries, rows=None):
+        if rows is not None:
+            return np.asarray(matrix[rows], dtype=np.float32) @ queries.T
+        scores = np.empty((len(matrix), len(queries)), dtype=np.float32)
+        for start in range(0, len(matrix), self.block_rows):
+            block = np.asarray(matrix[start:start + self.block_rows], dtype=np.float32)
+            scores[start:start + len(block)] = block @ queries.T
+        return scores
+
+    def search_batch(self, requests):
+        results = [None] * len(requests)
+        matrices, ids, type_masks, ivf, payloads = self._snapshot()
+        by_name = {}
+        for i, request in enumerate(requests):
+            use_ivf = bool(request.vector_name in ivf and self.nprobe and not request.exact)
+            by_name.setdefault((request.vector_name, use_ivf), []).append(i)
+
+        for (name, use_ivf), indices in by_name.items():
+            queries = np.stack([np.asarray(requests[i].vector, dtype=np.float32) for i in indices])
+            queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+            snapshot = (ids[name], type_masks[name], payloads)
+            if use_ivf:
+                for i, query in zip(indices, queries):
+                    rows = probe_ivf(ivf[name], query, self.nprobe)
+                    scores = self._scores(matrices[name], query[None, :], rows)[:, 0]
+                    results[i] = self._top_k(snapshot, scores, requests[i], rows)
+            else:
+                scores = self._scores(matrices[name], queries)
+                for column, i in enumerate(indices):
+                    results[i] = self._top_k(snapshot, scores[:, column], requests[i])
+        return results
+
+    def _top_k(self, snapshot, scores, request, rows=None):
+        ids, type_masks, payloads = snapshot
+        rows = np.arange(len(scores)) if rows is None else rows
+        if request.point_type is not None:
+            mask = type_masks.get(request.point_type)
+            if mask is None:
+                return []
+            if not mask.all():
+                scores = np.where(mask[rows], scores, -np.inf)
+        limit = min(request.limit, int(np.isfinite(scores).sum()))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [
+            SearchHit(ids[rows[i]], float(scores[i]), payloads[ids[rows[i]]])
+            for i in top
+        ]
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._payloads)
+
+
+def build_ivf(matrix, n_lists, iterations=10, sample_size=50000, seed=0):
+    """
+    Plain k-means over (a sample of) the rows; returns (centroids, assignments).
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(matrix, dtype=np.float32)
+    sample = data[rng.choice(len(data), min(sample_size, len(data)), replace=False)]
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        for k in range(n_lists):
+            members = sample[labels == k]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[k] = centroid / (np.linalg.norm(centroid) or 1.0)
+    assignments = np.concatenate([
+        np.argmax(data[start:start + 65536] @ centroids.T, axis=1)
+        for start in range(0, len(data), 65536)
+    ]).astype(np.int32)
+    return centroids, assignments
+
+
+def probe_ivf(ivf, query, nprobe):
+    centroids, assignments = ivf
+    lists = np.argsort(-(centroids @ query))[:nprobe]
+    return np.flatnonzero(np.isin(assignments, lists))
+
+
+def open_store(backend=None, collection_name=COLLECTION_NAME, **kwargs):
+    backend = backend or VECTOR_STORE_BACKEND
+    if backend == "qdrant":
+        return QdrantStore(collection_name=collection_name, **kwargs)
+    if backend == "numpy":
+        return NumpyStore(collection_name=collection_name, **kwargs)
+    raise ValueError(f"Unknown vector store backend: {backend}")
+
+
+def import_from_qdrant(source, target, batch_size=256):
+    """
+    Copies every point of a Qdrant collection (e.g. one restored from a snapshot) into another store.
+    """
+    if not target.collection_exists():
+        info = source.client.get_collection(source.collection_name)
+        vectors = info.config.params.vectors
+        if isinstance(vectors, dict):
+            vector_sizes = {name: params.size for name, params in vectors.items()}
+        else:
+            vector_sizes = {"text": vectors.size, "image": vectors.size}
+        target.create_collection(vector_sizes)
+
+    batch = []
+    imported = 0
+    for point in source.scroll(batch_size=batch_size):
+        batch.append(point)
+        if len(batch) >= batch_size:
+            target.upsert(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        target.upsert(batch)
+        imported += len(batch)
+    target.flush()
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a Qdrant collection into the embedded NumPy store.")
+    parser.add_argument('--collection', default=COLLECTION_NAME, help='Qdrant collection to import')
+    parser.add_argument('--path', default=NUMPY_STORE_PATH, help='Directory of the embedded store')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32', help='Stored vector precision')
+    parser.add_argument('--ivf-lists', type=int, default=None, help='Number of IVF partitions (exact search if unset)')
+    args = parser.parse_args()
+
+    source = QdrantStore(collection_name=args.collection)
+    target = NumpyStore(path=args.path, collection_name=args.collection, dtype=args.dtype, ivf_lists=args.ivf_lists)
+    count = import_from_qdrant(source, target)
+    print(f"Imported {count} points into {target.path}")